@@ -1,5 +1,6 @@
 
 import os
+import copy
 import scipy.io
 import numpy as np
 from collections import OrderedDict
@@ -9,79 +10,89 @@ import torch.nn.functional as F
 from torch.autograd import Variable
 import torch
 
+from model import LRN
+from quantize import *
+from flat_weights import *
+
 np.random.seed(123)
 torch.manual_seed(456)
 torch.cuda.manual_seed(789)
 
 
-class LRN(nn.Module):
-    def __init__(self):
-        super(LRN, self).__init__()
-
-    def forward(self, x):
-        #
-        # x: N x C x H x W
-        pad = Variable(x.data.new(x.size(0), 1, 1, x.size(2), x.size(3)).zero_())
-        x_sq = (x**2).unsqueeze(dim=1)
-        x_tile = torch.cat((torch.cat((x_sq,pad,pad,pad,pad),2),
-                            torch.cat((pad,x_sq,pad,pad,pad),2),
-                            torch.cat((pad,pad,x_sq,pad,pad),2),
-                            torch.cat((pad,pad,pad,x_sq,pad),2),
-                            torch.cat((pad,pad,pad,pad,x_sq),2)),1)
-        x_sumsq = x_tile.sum(dim=1).squeeze(dim=1)[:,2:-2,:,:]
-        x = x / ((2.+0.0001*x_sumsq)**0.75)
-        return x
-
-
 class Actor(nn.Module):
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, fused=False, widths=None):
         super(Actor, self).__init__()
-        if model_path is not None:
+        # fused: run both branches as groups=2 convolutions from weights packed
+        # by pack(), outside of training
+        self.fused = fused
+        self.packed = None
+        # int8 copy for eval mode passes, see quantize()
+        self.quantized = None
+        self.q_stale = False
+        # TorchScript forward for eval mode passes, see script()
+        self.scripted = None
+        self.scripted_in = None
+        tensors = None
+        if model_path is not None and os.path.splitext(model_path)[1] != '.flat':
             # read mat file from net_path and start TF Siamese graph from placeholders X and Z
             self.params_values_list = self._import_model(model_path)
         else:
             self.params_names_list = None
             self.params_values_list = None
-
-        self.conv1_l = nn.Conv2d(3, 96, kernel_size=7, stride=2)
+            if model_path is not None:
+                tensors = load_flat(model_path)
+        # conv1-conv4 output channels of both branches: 96, 256, 512, 512 for
+        # the VGG-M actor, fewer for one pruned by prune_models.py; read from
+        # a .flat weight file when not given
+        if widths is None and tensors is not None:
+            widths = [tensors['conv%d_l.weight' % (k)].size(0) for k in range(1, 5)]
+        self.widths = list(widths or [96, 256, 512, 512])
+        c1, c2, c3, c4 = self.widths
+
+        self.conv1_l = nn.Conv2d(3, c1, kernel_size=7, stride=2)
         self.relu1_l = nn.ReLU()
         self.LRNl1 = LRN()
         self.pool1_l = nn.MaxPool2d(kernel_size=3, stride=2)
 
-        self.conv2_l = nn.Conv2d(96, 256, kernel_size=5, stride=2)
+        self.conv2_l = nn.Conv2d(c1, c2, kernel_size=5, stride=2)
         self.relu2_l = nn.ReLU()
         self.LRNl2 = LRN()
         self.pool2_l = nn.MaxPool2d(kernel_size=3, stride=2)
 
-        self.conv3_l = nn.Conv2d(256, 512, kernel_size=3, stride=1)
+        self.conv3_l = nn.Conv2d(c2, c3, kernel_size=3, stride=1)
         self.relu3_l = nn.ReLU()
 
-        self.conv4_l = nn.Conv2d(512, 512, kernel_size=3, stride=2)
+        # with a shared backbone, conv4_l takes the critic's 512 channel conv3
+        self.conv4_l = nn.Conv2d(c3, c4, kernel_size=3, stride=2)
         self.relu4_l = nn.ReLU()
 
-        self.conv1_g = nn.Conv2d(3, 96, kernel_size=7, stride=2)
+        self.conv1_g = nn.Conv2d(3, c1, kernel_size=7, stride=2)
         self.relu1_g = nn.ReLU()
         self.LRNg1 = LRN()
         self.pool1_g = nn.MaxPool2d(kernel_size=3, stride=2)
 
-        self.conv2_g = nn.Conv2d(96, 256, kernel_size=5, stride=2)
+        self.conv2_g = nn.Conv2d(c1, c2, kernel_size=5, stride=2)
         self.relu2_g = nn.ReLU()
         self.LRNg2 = LRN()
         self.pool2_g = nn.MaxPool2d(kernel_size=3, stride=2)
 
-        self.conv3_g = nn.Conv2d(256, 512, kernel_size=3, stride=1)
+        self.conv3_g = nn.Conv2d(c2, c3, kernel_size=3, stride=1)
         self.relu3_g = nn.ReLU()
 
-        self.conv4_g = nn.Conv2d(512, 512, kernel_size=3, stride=2)
+        self.conv4_g = nn.Conv2d(c3, c4, kernel_size=3, stride=2)
         self.relu4_g = nn.ReLU()
 
-        self.fc1 = nn.Linear(1024, 512)
+        self.fc1 = nn.Linear(2 * c4, 512)
         self.relu5 = nn.ReLU()
 
         self.fc2 = nn.Linear(512, 3)
         self.out = nn.Tanh()
 
-        self.init_weight()
+        if self.params_values_list is not None:
+            self.init_weight()
+        elif tensors is not None:
+            assign_flat(self, tensors)
+            self.pack()
 
 
     def init_weight(self):
@@ -109,22 +120,109 @@ class Actor(nn.Module):
         self.fc1.bias.data = torch.from_numpy(np.squeeze(self.params_values_list['fc1'][1]))
         self.fc2.weight.data = torch.from_numpy(np.transpose(self.params_values_list['fc2'][0], [1, 0]))
         self.fc2.bias.data = torch.from_numpy(np.squeeze(self.params_values_list['fc2'][1]))
+        self.pack()
 
+    def pack(self):
+        #
+        # conv weights of the g and l branches stacked as the two groups of one
+        # grouped conv per layer, g first so that the output channels come out
+        # in the order forward concatenates them
+        # must be called again whenever the branch weights change; train()
+        # drops the packed weights and init_actor packs them after fine tuning
+        if not self.fused:
+            return
+        self.packed = []
+        for k in range(1, 5):
+            conv_g = getattr(self, 'conv%d_g' % (k))
+            conv_l = getattr(self, 'conv%d_l' % (k))
+            weight = torch.cat([conv_g.weight.data, conv_l.weight.data], 0)
+            bias = torch.cat([conv_g.bias.data, conv_l.bias.data], 0)
+            self.packed.append((Variable(weight), Variable(bias), conv_g.stride))
+
+    def quantize(self, mode, xl=None, xg=None, in_layer='conv1'):
+        #
+        # int8 copy of the actor that forward runs on until the next train()
+        # mode 'fc': dynamic int8 fc1-fc2
+        # mode 'all': also static int8 conv layers of both branches, whose
+        # activation ranges are calibrated on a batch of xl, xg inputs
+        # (conv1_l-conv3_l only when in_layer is 'conv1')
+        # the actor is only trained by init_actor, so quantize after it
+        check_quantization()
+        self.quantized = None
+        scripted = self.scripted
+        self.__dict__['scripted'] = None
+        qactor = copy.deepcopy(self)
+        self.__dict__['scripted'] = scripted
+        qactor.fused = False
+        qactor.packed = None
+        if mode == 'all':
+            prepared = []
+            for name in ['1_g', '2_g', '3_g', '4_g', '1_l', '2_l', '3_l', '4_l']:
+                if in_layer == 'conv4' and name in ['1_l', '2_l', '3_l']:
+                    continue
+                q = prepare_conv_relu(getattr(qactor, 'conv' + name), getattr(qactor, 'relu' + name))
+                setattr(qactor, 'conv' + name, q)
+                setattr(qactor, 'relu' + name, nn.Sequential())
+                prepared.append(q)
+            qactor(xl, xg, in_layer)
+            convert_modules(prepared)
+        qactor.fc1 = quantize_linear(qactor.fc1)
+        qactor.fc2 = quantize_linear(qactor.fc2)
+        qactor.eval()
+        # kept out of the module tree, see MDNet.quantize
+        self.__dict__['quantized'] = qactor
+        self.q_stale = False
+
+    def script(self, scripted, in_layer='conv1'):
+        #
+        # scripted: forward from in_layer, from trace_actor or load_scripted,
+        # run on this actor's parameters instead of the eager layers by eval
+        # mode passes from in_layer; the int8 copy still takes precedence
+        # kept out of the module tree, see quantize()
+        self.__dict__['scripted'] = scripted
+        self.scripted_in = in_layer
+
+    def train(self, mode=True):
+        if mode:
+            self.packed = None
+            self.q_stale = True
+        return super(Actor, self).train(mode)
+
+    def _apply(self, fn):
+        # keep the packed weights on the same device as the parameters
+        super(Actor, self)._apply(fn)
+        if self.packed is not None:
+            self.pack()
+        return self
 
     def _import_model(self, net_path):
         return  np.load(net_path, encoding='latin1').item()
 
-    def forward(self, xl, xg):
-        xl = self.conv1_l(xl)
-        xl = self.relu1_l(xl)
-        xl = self.LRNl1(xl)
-        xl = self.pool1_l(xl)
-        xl = self.conv2_l(xl)
-        xl = self.relu2_l(xl)
-        xl = self.LRNl2(xl)
-        xl = self.pool2_l(xl)
-        xl = self.conv3_l(xl)
-        xl = self.relu3_l(xl)
+    def forward(self, xl, xg, in_layer='conv1'):
+        #
+        # in_layer 'conv4': xl is already a N x 512 x 3 x 3 conv3 map of the
+        # local crop, e.g. from a conv1-conv3 backbone shared with the critic
+        if self.quantized is not None and not self.q_stale:
+            return self.quantized(xl, xg, in_layer)
+        if self.scripted is not None and in_layer == self.scripted_in and not self.training:
+            return self.scripted(xl, xg)
+        if self.packed is not None and in_layer == 'conv1':
+            return self.forward_fused(xl, xg)
+        return self.forward_branches(xl, xg, in_layer)
+
+    def forward_branches(self, xl, xg, in_layer='conv1'):
+        # the local and global branches one after the other
+        if in_layer == 'conv1':
+            xl = self.conv1_l(xl)
+            xl = self.relu1_l(xl)
+            xl = self.LRNl1(xl)
+            xl = self.pool1_l(xl)
+            xl = self.conv2_l(xl)
+            xl = self.relu2_l(xl)
+            xl = self.LRNl2(xl)
+            xl = self.pool2_l(xl)
+            xl = self.conv3_l(xl)
+            xl = self.relu3_l(xl)
         xl = self.conv4_l(xl)
         xl = self.relu4_l(xl)
 
@@ -150,5 +248,133 @@ class Actor(nn.Module):
 
         return x
 
+    def forward_fused(self, xl, xg):
+        #
+        # same as forward, with the two branches run as the two groups of
+        # grouped convolutions over the channel-concatenated input
+        x = torch.cat([xg, xl], dim=1)
+        for k, (weight, bias, stride) in enumerate(self.packed):
+            x = F.relu(F.conv2d(x, weight, bias, stride=stride, groups=2))
+            if k < 2:
+                # LRN must not mix channels of the two branches
+                n, c, h, w = x.size()
+                x = self.LRNg1(x.view(n * 2, c // 2, h, w)).view(n, c, h, w)
+                x = F.max_pool2d(x, kernel_size=3, stride=2)
 
+        x = x.view(x.size(0), -1)
+        x = self.fc1(x)
+        x = self.relu5(x)
+        x = self.fc2(x)
+        x = self.out(x)
+
+        return x
+
+
+class LiteActor(nn.Module):
+    #
+    # small stand-in for Actor with the same interface, trained to reproduce
+    # its outputs by tracking/distill_actor.py: per branch a plain conv1 and
+    # depthwise separable conv2-conv4 (a depthwise conv then a 1 x 1 conv),
+    # widths[k] output channels at conv(k+1), with the teacher's kernel sizes,
+    # strides and pooling, so that 107 x 107 crops still end in 1 x 1 maps
+    # only runs from conv1 (not combined with shared_backbone)
+    def __init__(self, model_path=None, widths=(32, 64, 128, 128)):
+        super(LiteActor, self).__init__()
+        # the widths of a weight file are those it was trained with
+        tensors = load_flat(model_path) if model_path is not None else None
+        if tensors is not None:
+            widths = [tensors['branch_l.conv%d.%d.weight' % (k, int(k > 1))].size(0) for k in range(1, 5)]
+        self.widths = list(widths)
+        self.quantized = None
+        self.q_stale = False
+        self.scripted = None
+        self.scripted_in = None
+
+        self.branch_l = self.make_branch(self.widths)
+        self.branch_g = self.make_branch(self.widths)
+
+        self.fc1 = nn.Linear(2 * self.widths[3], 2 * self.widths[3])
+        self.relu5 = nn.ReLU()
+
+        self.fc2 = nn.Linear(2 * self.widths[3], 3)
+        self.out = nn.Tanh()
 
+        if tensors is not None:
+            assign_flat(self, tensors)
+
+    def make_branch(self, widths):
+        c1, c2, c3, c4 = widths
+        return nn.Sequential(OrderedDict([
+            ('conv1', nn.Sequential(nn.Conv2d(3, c1, kernel_size=7, stride=2), nn.ReLU())),
+            ('pool1', nn.MaxPool2d(kernel_size=3, stride=2)),
+            ('conv2', self.separable(c1, c2, 5, 2)),
+            ('pool2', nn.MaxPool2d(kernel_size=3, stride=2)),
+            ('conv3', self.separable(c2, c3, 3, 1)),
+            ('conv4', self.separable(c3, c4, 3, 2))]))
+
+    def separable(self, in_channels, out_channels, kernel_size, stride):
+        return nn.Sequential(nn.Conv2d(in_channels, in_channels, kernel_size=kernel_size, stride=stride,
+                                       groups=in_channels),
+                             nn.Conv2d(in_channels, out_channels, kernel_size=1),
+                             nn.ReLU())
+
+    def pack(self):
+        # nothing to pack, the branches are small enough to run one by one
+        return
+
+    def quantize(self, mode, xl=None, xg=None, in_layer='conv1'):
+        #
+        # int8 copy as Actor.quantize: mode 'all' also quantizes conv1 and the
+        # 1 x 1 convs of both branches, the depthwise convs stay float
+        check_quantization()
+        self.quantized = None
+        scripted = self.scripted
+        self.__dict__['scripted'] = None
+        qactor = copy.deepcopy(self)
+        self.__dict__['scripted'] = scripted
+        if mode == 'all':
+            prepared = []
+            for branch in [qactor.branch_g, qactor.branch_l]:
+                for k in range(1, 5):
+                    block = getattr(branch, 'conv%d' % (k))
+                    n = len(block)
+                    q = prepare_conv_relu(block[n - 2], block[n - 1])
+                    setattr(block, str(n - 2), q)
+                    setattr(block, str(n - 1), nn.Sequential())
+                    prepared.append(q)
+            qactor(xl, xg, in_layer)
+            convert_modules(prepared)
+        qactor.fc1 = quantize_linear(qactor.fc1)
+        qactor.fc2 = quantize_linear(qactor.fc2)
+        qactor.eval()
+        self.__dict__['quantized'] = qactor
+        self.q_stale = False
+
+    def script(self, scripted, in_layer='conv1'):
+        # see Actor.script
+        self.__dict__['scripted'] = scripted
+        self.scripted_in = in_layer
+
+    def train(self, mode=True):
+        if mode:
+            self.q_stale = True
+        return super(LiteActor, self).train(mode)
+
+    def forward(self, xl, xg, in_layer='conv1'):
+        if self.quantized is not None and not self.q_stale:
+            return self.quantized(xl, xg, in_layer)
+        if self.scripted is not None and in_layer == self.scripted_in and not self.training:
+            return self.scripted(xl, xg)
+        return self.forward_branches(xl, xg, in_layer)
+
+    def forward_branches(self, xl, xg, in_layer='conv1'):
+        if in_layer != 'conv1':
+            raise RuntimeError("LiteActor runs from conv1 only")
+        x = torch.cat([self.branch_g(xg), self.branch_l(xl)], dim=1)
+        x = x.view(x.size(0), -1)
+        x = self.fc1(x)
+        x = self.relu5(x)
+        x = self.fc2(x)
+        x = self.out(x)
+
+        return x
@@ -0,0 +1,39 @@
+import os
+import subprocess
+
+import torch
+import torch.nn as nn
+
+
+def set_cpu_threads(threads=0, interop_threads=0):
+    #
+    # intra-op threads of the calling thread and inter-op threads of the
+    # process (0: keep the default); the inter-op pool can only be sized
+    # before it is first used, later calls leave it as it is
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if interop_threads > 0 and hasattr(torch, 'set_num_interop_threads'):
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            pass
+
+
+def set_cpu_affinity(cores):
+    #
+    # pin every thread of this process to cores (list of core ids) with
+    # taskset -a; threads started later inherit the mask of the thread that
+    # starts them
+    cores = sorted(set(int(c) for c in cores))
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(['taskset', '-a', '-p', '-c', ','.join(map(str, cores)), str(os.getpid())],
+                              stdout=devnull)
+
+
+def inplace_relu(module):
+    # ReLUs of module applied in place on the output of the layer before
+    for m in module.modules():
+        if isinstance(m, nn.ReLU):
+            m.inplace = True
+    return module
+
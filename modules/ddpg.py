@@ -17,6 +17,8 @@ from options import *
 actor_list = ['conv1', 'conv2', 'conv3','conv4', 'fc1', 'fc2', 'fc3']
 from data_prov import *
 from sample_generator import *
+from model import LRN
+from flat_weights import load_flat, assign_flat
 # plt.scatter(x.data.numpy(), y.data.numpy())
 # plt.show()
 def append_params(params, module, prefix):
@@ -34,24 +36,6 @@ def append_params(params, module, prefix):
             else:
                 raise RuntimeError("Duplicated param name: %s" % (name))
 
-class LRN(nn.Module):
-    def __init__(self):
-        super(LRN, self).__init__()
-
-    def forward(self, x):
-        #
-        # x: N x C x H x W
-        pad = Variable(x.data.new(x.size(0), 1, 1, x.size(2), x.size(3)).zero_())
-        x_sq = (x**2).unsqueeze(dim=1)
-        x_tile = torch.cat((torch.cat((x_sq,pad,pad,pad,pad),2),
-                            torch.cat((pad,x_sq,pad,pad,pad),2),
-                            torch.cat((pad,pad,x_sq,pad,pad),2),
-                            torch.cat((pad,pad,pad,x_sq,pad),2),
-                            torch.cat((pad,pad,pad,pad,x_sq),2)),1)
-        x_sumsq = x_tile.sum(dim=1).squeeze(dim=1)[:,2:-2,:,:]
-        x = x / ((2.+0.0001*x_sumsq)**0.75)
-        return x
-
 class DDPG(nn.Module):
     def __init__(self, model_path=None, K=1):
         super(DDPG, self).__init__()
@@ -81,6 +65,8 @@ class DDPG(nn.Module):
                 self.load_model(model_path)
             elif os.path.splitext(model_path)[1] == '.npy':
                 self.load_npy_model(model_path)
+            elif os.path.splitext(model_path)[1] == '.flat':
+                assign_flat(self, load_flat(model_path))
             else:
                 raise RuntimeError("Unkown model format: %s" % (model_path))
         self.build_param_dict()
@@ -0,0 +1,173 @@
+import os
+import json
+import struct
+import scipy.io
+import numpy as np
+from collections import OrderedDict
+
+import torch
+
+#
+# flat weight files (.flat): named arrays in PyTorch layout that are mapped
+# into memory instead of being read, unpickled and transposed
+# layout: FLAT_MAGIC, uint64 (little endian) header length, JSON header
+# {"tensors": [[name, dtype, shape, offset], ...]}, then the arrays from the
+# first FLAT_ALIGN byte boundary after the header on, at FLAT_ALIGN aligned
+# offsets from there
+# names are those of the target module's named_parameters(); entries with
+# the same offset are one array, as tied weights are in the module
+FLAT_MAGIC = 'ACTFLAT1'
+FLAT_ALIGN = 64
+
+# layers of an actor .npy
+_npy_layers = ['conv1', 'conv2', 'conv3', 'conv4', 'fc1', 'fc2']
+
+
+def _align(n):
+    return (n + FLAT_ALIGN - 1) // FLAT_ALIGN * FLAT_ALIGN
+
+
+def save_flat(arrays, path):
+    #
+    # arrays: OrderedDict of name -> numpy array or tensor
+    # arrays that are views of the same memory are written once
+    entries = []
+    blobs = []
+    seen = {}
+    offset = 0
+    for name, a in arrays.iteritems():
+        if torch.is_tensor(a):
+            a = a.cpu().numpy()
+        key = (a.__array_interface__['data'][0], a.shape, a.strides, a.dtype.str)
+        if key not in seen:
+            seen[key] = offset
+            blobs.append((offset, np.ascontiguousarray(a)))
+            offset = _align(offset + a.nbytes)
+        entries.append([name, a.dtype.str, list(a.shape), seen[key]])
+
+    header = json.dumps({'tensors': entries})
+    start = _align(len(FLAT_MAGIC) + 8 + len(header))
+    with open(path, 'wb') as f:
+        f.write(FLAT_MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for blob_offset, a in blobs:
+            f.seek(start + blob_offset)
+            f.write(a.tobytes())
+        f.truncate(start + offset)
+
+
+def load_flat(path):
+    #
+    # OrderedDict of name -> tensor, each a view of one copy-on-write mapping
+    # of the file: nothing is read before it is used, and pages are only
+    # copied when the tensor is written to (e.g. by online training)
+    with open(path, 'rb') as f:
+        if f.read(len(FLAT_MAGIC)) != FLAT_MAGIC:
+            raise RuntimeError("Not a flat weight file: %s" % (path))
+        header_len, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len))
+    start = _align(len(FLAT_MAGIC) + 8 + header_len)
+
+    mapped = np.memmap(path, dtype='uint8', mode='c')
+    tensors = OrderedDict()
+    for name, dtype, shape, offset in header['tensors']:
+        a = np.ndarray(shape, dtype=np.dtype(str(dtype)), buffer=mapped, offset=start + offset)
+        tensors[str(name)] = torch.from_numpy(a)
+    return tensors
+
+
+def assign_flat(module, tensors):
+    #
+    # points the parameters of module named in tensors at them (no copy);
+    # parameters missing from tensors keep their values
+    params = dict(module.named_parameters())
+    for name in tensors:
+        if name not in params:
+            raise RuntimeError("Unknown parameter in weight file: %s" % (name))
+    for name, p in params.iteritems():
+        if name in tensors:
+            if tensors[name].size() != p.size():
+                raise RuntimeError("Shape mismatch of %s in weight file" % (name))
+            p.data = tensors[name]
+
+
+def untie_flat(module, params):
+    #
+    # gives each of params that shares its memory with another parameter of
+    # module (one array of the file, e.g. the conv layers of the two actor
+    # branches) a copy of its own, so that training it leaves the others as
+    # they are
+    counts = {}
+    for p in module.parameters():
+        counts[p.data.data_ptr()] = counts.get(p.data.data_ptr(), 0) + 1
+    for p in params:
+        ptr = p.data.data_ptr()
+        if counts[ptr] > 1:
+            counts[ptr] -= 1
+            p.data = p.data.clone()
+
+
+def pth_weights(path):
+    # shared layers of a critic .pth (MDNet or DDPG)
+    states = torch.load(path, map_location='cpu')
+    return OrderedDict([('layers.' + k, v) for k, v in states['shared_layers'].iteritems()])
+
+
+def mat_weights(path):
+    # conv1-conv3 of a MatConvNet critic .mat, as MDNet.load_mat_model reads them
+    mat = scipy.io.loadmat(path)
+    mat_layers = list(mat['layers_new'])[0]
+    arrays = OrderedDict()
+    for i in range(3):
+        weight, bias = mat_layers[i*4]['weights'].item()[0]
+        arrays['layers.conv%d.0.weight' % (i + 1)] = np.transpose(weight, (3, 2, 0, 1))
+        arrays['layers.conv%d.0.bias' % (i + 1)] = bias[0, :]
+    return arrays
+
+
+def npy_actor_weights(path):
+    # actor .npy, as Actor.init_weight reads it: both branches share conv1-conv4
+    values = np.load(path, encoding='latin1', allow_pickle=True).item()
+    arrays = OrderedDict()
+    for name in _npy_layers[:4]:
+        weight = np.transpose(values[name][0], [3, 2, 0, 1])
+        bias = np.squeeze(values[name][1])
+        for branch in ['l', 'g']:
+            arrays['%s_%s.weight' % (name, branch)] = weight
+            arrays['%s_%s.bias' % (name, branch)] = bias
+    for name in _npy_layers[4:]:
+        arrays[name + '.weight'] = np.transpose(values[name][0], [1, 0])
+        arrays[name + '.bias'] = np.squeeze(values[name][1])
+    return arrays
+
+
+def npy_ddpg_weights(path):
+    # actor .npy, as DDPG.load_npy_model reads it
+    values = np.load(path, allow_pickle=True).item()
+    arrays = OrderedDict()
+    for i, layer in enumerate(['conv1', 'conv2', 'conv3', 'conv4', 'fc1', 'fc3']):
+        weight, bias = values[_npy_layers[i]][0], values[_npy_layers[i]][1]
+        axes = (3, 2, 0, 1) if i < 4 else (1, 0)
+        arrays['layers.%s.0.weight' % (layer)] = np.transpose(weight, axes)
+        arrays['layers.%s.0.bias' % (layer)] = bias
+    return arrays
+
+
+def convert_weights(src, dst, target='critic'):
+    #
+    # writes the weights in src (.pth, .mat or .npy) as a flat file dst for
+    # target 'critic' (MDNet), 'actor' (Actor) or 'ddpg' (DDPG)
+    ext = os.path.splitext(src)[1]
+    if ext == '.pth' and target in ['critic', 'ddpg']:
+        arrays = pth_weights(src)
+    elif ext == '.mat' and target == 'critic':
+        arrays = mat_weights(src)
+    elif ext == '.npy' and target == 'actor':
+        arrays = npy_actor_weights(src)
+    elif ext == '.npy' and target == 'ddpg':
+        arrays = npy_ddpg_weights(src)
+    else:
+        raise RuntimeError("Cannot convert %s weights for %s" % (ext, target))
+    save_flat(arrays, dst)
+    return arrays
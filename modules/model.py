@@ -1,4 +1,5 @@
 import os
+import copy
 import scipy.io
 import numpy as np
 from collections import OrderedDict
@@ -8,6 +9,9 @@ import torch.nn.functional as F
 from torch.autograd import Variable
 import torch
 
+from quantize import *
+from flat_weights import *
+
 def append_params(params, module, prefix):
     for child in module.children():
         for k,p in child._parameters.iteritems():
@@ -31,32 +35,132 @@ class LRN(nn.Module):
     def forward(self, x):
         #
         # x: N x C x H x W
-        pad = Variable(x.data.new(x.size(0), 1, 1, x.size(2), x.size(3)).zero_())
-        x_sq = (x**2).unsqueeze(dim=1)
-        x_tile = torch.cat((torch.cat((x_sq,pad,pad,pad,pad),2),
-                            torch.cat((pad,x_sq,pad,pad,pad),2),
-                            torch.cat((pad,pad,x_sq,pad,pad),2),
-                            torch.cat((pad,pad,pad,x_sq,pad),2),
-                            torch.cat((pad,pad,pad,pad,x_sq),2)),1)
-        x_sumsq = x_tile.sum(dim=1).squeeze(dim=1)[:,2:-2,:,:]
+        # the sum of x^2 over each window of 5 channels is a zero padded
+        # average pool over the channel axis of a N x 1 x C x HW view
+        x_sq = (x**2).view(x.size(0), 1, x.size(1), -1)
+        x_sumsq = 5 * F.avg_pool2d(x_sq, (5, 1), stride=1, padding=(2, 0))
+        x_sumsq = x_sumsq.view(x.size())
         x = x / ((2.+0.0001*x_sumsq)**0.75)
         return x
 
 
+class RoIAlign(nn.Module):
+    def __init__(self, crop_size=107, out_size=3, stride=16, offset=37, sampling_ratio=2):
+        super(RoIAlign, self).__init__()
+        # conv3 cell k of a crop_size input is centered at pixel offset + stride*k
+        self.crop_size = crop_size
+        self.out_size = out_size
+        self.stride = stride
+        self.offset = offset
+        self.sampling_ratio = sampling_ratio
+
+    def forward(self, feat, crops):
+        #
+        # feat: 1 x C x H x W conv3 map of the search region
+        # crops: N x [x,y,w,h] crop windows in search region pixels
+        # returns N x C x out_size x out_size, as if each window had been
+        # cropped, resized to crop_size and passed through conv1-conv3
+        C, H, W = feat.size(1), feat.size(2), feat.size(3)
+        n = crops.shape[0]
+        s = self.sampling_ratio
+        p = self.out_size * s
+
+        # sample positions inside each bin, in feature map coordinates
+        grid = (np.arange(p, dtype='float32') + 0.5) / s - 0.5
+        scale = crops[:,2:] / float(self.crop_size)
+        xs = (crops[:,0:1] + (self.offset + self.stride * grid[None,:]) * scale[:,0:1] - self.offset) / self.stride
+        ys = (crops[:,1:2] + (self.offset + self.stride * grid[None,:]) * scale[:,1:2] - self.offset) / self.stride
+        xs = np.clip(xs, 0, W - 1)
+        ys = np.clip(ys, 0, H - 1)
+
+        x0 = np.floor(xs).astype('int64')
+        y0 = np.floor(ys).astype('int64')
+        x1 = np.minimum(x0 + 1, W - 1)
+        y1 = np.minimum(y0 + 1, H - 1)
+        lx = (xs - x0).astype('float32')
+        ly = (ys - y0).astype('float32')
+
+        # N x p x p bilinear corners and weights
+        corners = [(y0, x0, (1 - ly)[:,:,None] * (1 - lx)[:,None,:]),
+                   (y0, x1, (1 - ly)[:,:,None] * lx[:,None,:]),
+                   (y1, x0, ly[:,:,None] * (1 - lx)[:,None,:]),
+                   (y1, x1, ly[:,:,None] * lx[:,None,:])]
+
+        feat = feat.view(C, H * W)
+        pooled = None
+        for yi, xi, w in corners:
+            idx = (yi[:,:,None] * W + xi[:,None,:]).reshape(-1)
+            idx = torch.from_numpy(idx)
+            w = torch.from_numpy(np.ascontiguousarray(w.reshape(1, -1)))
+            if feat.is_cuda:
+                idx = idx.cuda()
+                w = w.cuda()
+            v = feat.index_select(1, Variable(idx)) * Variable(w)
+            pooled = v if pooled is None else pooled + v
+
+        pooled = pooled.view(C, n, self.out_size, s, self.out_size, s)
+        pooled = pooled.mean(5).mean(3)
+        return pooled.permute(1, 0, 2, 3).contiguous()
+
+
+class SeededDropout(nn.Module):
+    #
+    # dropout with its masks drawn from rng (a numpy RandomState) instead of
+    # torch's global generator, for a model trained on a thread other than
+    # the one that reseeds torch
+    def __init__(self, p, rng):
+        super(SeededDropout, self).__init__()
+        self.p = p
+        self.rng = rng
+
+    def forward(self, x):
+        if not self.training or self.p == 0:
+            return x
+        mask = (self.rng.rand(*x.size()) >= self.p).astype('float32') / (1 - self.p)
+        mask = torch.from_numpy(mask)
+        if x.is_cuda:
+            mask = mask.cuda()
+        return x * Variable(mask)
+
+
+def critic_widths(model_path):
+    # conv1 and conv2 output channels of the critic weights at model_path
+    ext = os.path.splitext(model_path)[1]
+    if ext == '.pth':
+        layers = torch.load(model_path, map_location='cpu')['shared_layers']
+        return layers['conv1.0.weight'].size(0), layers['conv2.0.weight'].size(0)
+    if ext == '.flat':
+        tensors = load_flat(model_path)
+        return tensors['layers.conv1.0.weight'].size(0), tensors['layers.conv2.0.weight'].size(0)
+    return 96, 256
+
+
 class MDNet(nn.Module):
-    def __init__(self, model_path=None, K=1):
+    def __init__(self, model_path=None, K=1, widths=None):
         super(MDNet, self).__init__()
         self.K = K
+        # conv1 and conv2 output channels: 96 and 256 for the VGG-M critic,
+        # fewer for one distilled by distill_critic.py; conv3 keeps its 512
+        # channels, so fc4-fc6 take the same features either way
+        # read from the weight file when not given
+        if widths is None:
+            widths = critic_widths(model_path) if model_path is not None else (96, 256)
+        self.widths = tuple(widths)
+        # int8 copy for eval mode passes, see quantize()
+        self.quantized = None
+        self.q_stale = False
+        # TorchScript entry points for float passes, see script()
+        self.scripted = None
         self.layers = nn.Sequential(OrderedDict([
-                ('conv1', nn.Sequential(nn.Conv2d(3, 96, kernel_size=7, stride=2),
+                ('conv1', nn.Sequential(nn.Conv2d(3, self.widths[0], kernel_size=7, stride=2),
                                         nn.ReLU(),
                                         LRN(),
                                         nn.MaxPool2d(kernel_size=3, stride=2))),
-                ('conv2', nn.Sequential(nn.Conv2d(96, 256, kernel_size=5, stride=2),
+                ('conv2', nn.Sequential(nn.Conv2d(self.widths[0], self.widths[1], kernel_size=5, stride=2),
                                         nn.ReLU(),
                                         LRN(),
                                         nn.MaxPool2d(kernel_size=3, stride=2))),
-                ('conv3', nn.Sequential(nn.Conv2d(256, 512, kernel_size=3, stride=1),
+                ('conv3', nn.Sequential(nn.Conv2d(self.widths[1], 512, kernel_size=3, stride=1),
                                         nn.ReLU())),
                 ('fc4',   nn.Sequential(nn.Dropout(0.5),
                                         nn.Linear(512 * 3 * 3, 512),
@@ -67,12 +171,17 @@ class MDNet(nn.Module):
         
         self.branches = nn.ModuleList([nn.Sequential(nn.Dropout(0.5), 
                                                      nn.Linear(512, 2)) for _ in range(K)])
+
+        # pools per-box conv3 features out of a shared search region map
+        self.roi_align = RoIAlign()
         
         if model_path is not None:
             if os.path.splitext(model_path)[1] == '.pth':
                 self.load_model(model_path)
             elif os.path.splitext(model_path)[1] == '.mat':
                 self.load_mat_model(model_path)
+            elif os.path.splitext(model_path)[1] == '.flat':
+                assign_flat(self, load_flat(model_path))
             else:
                 raise RuntimeError("Unkown model format: %s" % (model_path))
         self.build_param_dict()
@@ -98,10 +207,113 @@ class MDNet(nn.Module):
                 params[k] = p
         return params
     
+    def quantize(self, mode, regions=None):
+        #
+        # int8 copy of the model that eval mode forward passes run on
+        # mode 'fc': dynamic int8 fc4-fc6
+        # mode 'all': also static int8 conv1-conv3, whose activation ranges are
+        # calibrated on regions (N x 3 x 107 x 107 crops); LRN and pooling
+        # stay float
+        # the float layers stay the master copy that online updates train:
+        # train() marks the copy stale, so the float model is used until
+        # requantize() rebuilds fc4-fc6 from the updated weights (conv1-conv3
+        # are not updated online)
+        check_quantization()
+        self.quantized = None
+        scripted = self.scripted
+        self.__dict__['scripted'] = None
+        qmodel = copy.deepcopy(self)
+        self.__dict__['scripted'] = scripted
+        if mode == 'all':
+            prepared = []
+            for name in ['conv1', 'conv2', 'conv3']:
+                block = list(qmodel.layers._modules[name].children())
+                q = prepare_conv_relu(block[0], block[1])
+                qmodel.layers._modules[name] = nn.Sequential(q, *block[2:])
+                prepared.append(q)
+            qmodel.forward_map(regions)
+            convert_modules(prepared)
+        # kept out of the module tree, so that parameters(), cuda() and
+        # state_dict() only see the float model
+        self.__dict__['quantized'] = qmodel
+        self.requantize()
+
+    def requantize(self):
+        if self.quantized is None:
+            return
+        for name in ['fc4', 'fc5']:
+            self.quantized.layers._modules[name] = quantize_linear(self.layers._modules[name])
+        self.quantized.branches = quantize_linear(self.branches)
+        self.quantized.eval()
+        self.q_stale = False
+
+    def use_quantized(self):
+        return self.quantized is not None and not self.training and not self.q_stale
+
+    def train(self, mode=True):
+        if mode:
+            self.q_stale = True
+        return super(MDNet, self).train(mode)
+
+    def script(self, scripted):
+        #
+        # scripted: 'backbone', 'head' and 'step' modules from trace_critic or
+        # load_scripted, run on this model's parameters
+        # eval mode passes from conv1 or fc4 to conv3-fc6 of branch 0 go
+        # through the backbone and the head, train_loss through the step;
+        # the int8 copy still takes precedence
+        # kept out of the module tree, see quantize()
+        self.__dict__['scripted'] = scripted
+
+    def head_weights(self, k=0):
+        # fc4-fc6 weights and biases of branch k, as passed to the scripted step
+        return (self.layers.fc4[1].weight, self.layers.fc4[1].bias,
+                self.layers.fc5[1].weight, self.layers.fc5[1].bias,
+                self.branches[k][1].weight, self.branches[k][1].bias)
+
+    def use_scripted(self, k, in_layer, out_layers):
+        return self.scripted is not None and not self.training and k == 0 and \
+            in_layer in ['conv1', 'fc4'] and all([l in ['conv3', 'fc4', 'fc5', 'fc6'] for l in out_layers])
+
+    def forward_scripted(self, x, in_layer, out_layers):
+        outputs = {}
+        if in_layer == 'conv1':
+            x = self.scripted['backbone'](x)
+            x = x.reshape(x.size(0), -1)
+            outputs['conv3'] = x
+        if any([l != 'conv3' for l in out_layers]):
+            outputs['fc4'], outputs['fc5'], outputs['fc6'] = self.scripted['head'](x)
+        return [outputs[l] for l in out_layers]
+
+    def train_loss(self, pos_feats, neg_feats, criterion, in_layer='fc4'):
+        # criterion of the scores of pos and neg features, from one pass of the
+        # scripted step when there is one
+        if self.scripted is not None and in_layer == 'fc4' and isinstance(criterion, BinaryLoss):
+            return self.scripted['step'](pos_feats, neg_feats, *self.head_weights())
+        pos_score = self(pos_feats, in_layer=in_layer)
+        neg_score = self(neg_feats, in_layer=in_layer)
+        return criterion(pos_score, neg_score)
+
     def forward(self, x, k=0, in_layer='conv1', out_layer='fc6'):
         #
         # forward model from in_layer to out_layer
+        # out_layer may be a list of layers, whose outputs are all taken
+        # from the same pass and returned in that order
+        if self.use_quantized():
+            return self.quantized(x, k, in_layer, out_layer)
+
+        if isinstance(out_layer, (list, tuple)):
+            out_layers = list(out_layer)
+        else:
+            out_layers = [out_layer]
+
+        if self.use_scripted(k, in_layer, out_layers):
+            outputs = self.forward_scripted(x, in_layer, out_layers)
+            if isinstance(out_layer, (list, tuple)):
+                return outputs
+            return outputs[0]
 
+        outputs = {}
         run = False
         for name, module in self.layers.named_children():
             if name == in_layer:
@@ -110,15 +322,45 @@ class MDNet(nn.Module):
                 x = module(x)
                 if name == 'conv3':
                     x = x.view(x.size(0),-1)
-                if name == out_layer:
-                    return x
+                if name in out_layers:
+                    outputs[name] = x
+                    if len(outputs) == len(out_layers):
+                        break
         
-        x = self.branches[k](x)
-        if out_layer=='fc6':
-            return x
-        elif out_layer=='fc6_softmax':
-            return F.softmax(x)
-    
+        if len(outputs) < len(out_layers):
+            x = self.branches[k](x)
+            if 'fc6' in out_layers:
+                outputs['fc6'] = x
+            if 'fc6_softmax' in out_layers:
+                outputs['fc6_softmax'] = F.softmax(x)
+
+        if isinstance(out_layer, (list, tuple)):
+            return [outputs[l] for l in out_layers]
+        return outputs.get(out_layer)
+
+    def forward_map(self, x):
+        #
+        # conv1-conv3 over an input of any size, keeping the spatial layout
+        if self.use_quantized():
+            return self.quantized.forward_map(x)
+        if self.scripted is not None and not self.training:
+            return self.scripted['backbone'](x)
+        for name in ['conv1', 'conv2', 'conv3']:
+            x = getattr(self.layers, name)(x)
+        return x
+
+    def forward_dense(self, x, k=0):
+        #
+        # fc4-fc6 run as convolutions over a conv3 map, giving the fc6 score
+        # of every 3x3 window: fc4 becomes a 3x3 conv, fc5 and fc6 1x1 convs
+        fc4 = self.layers.fc4[1]
+        fc5 = self.layers.fc5[1]
+        fc6 = self.branches[k][1]
+        x = F.relu(F.conv2d(x, fc4.weight.view(fc4.out_features, -1, 3, 3), fc4.bias))
+        x = F.relu(F.conv2d(x, fc5.weight.view(fc5.out_features, -1, 1, 1), fc5.bias))
+        x = F.conv2d(x, fc6.weight.view(fc6.out_features, -1, 1, 1), fc6.bias)
+        return x
+
     def load_model(self, model_path):
         states = torch.load(model_path)
         shared_layers = states['shared_layers']
@@ -157,7 +399,7 @@ class Accuracy():
         pos_acc = pos_correct / (pos_score.size(0) + 1e-8)
         neg_acc = neg_correct / (neg_score.size(0) + 1e-8)
 
-        return pos_acc.data[0], neg_acc.data[0]
+        return float(pos_acc.data.cpu().numpy()), float(neg_acc.data.cpu().numpy())
 
 
 class Precision():
@@ -167,4 +409,4 @@ class Precision():
         topk = torch.topk(scores, pos_score.size(0))[1]
         prec = (topk < pos_score.size(0)).float().sum() / (pos_score.size(0)+1e-8)
         
-        return prec.data[0]
+        return float(prec.data.cpu().numpy())
@@ -0,0 +1,114 @@
+import numpy as np
+from collections import OrderedDict
+
+import torch.nn.functional as F
+import torch
+
+#
+# structured (whole channel) pruning of the critic's conv1-conv2 and the
+# actor's conv1-conv4: channels are ranked, the lowest ranked ones removed
+# from the layer's filters and from the input of the layer after it, and the
+# result returned as named arrays for save_flat, which MDNet and Actor load
+# with their narrower widths
+# the critic's conv3 keeps its 512 channels, as fc4 and a shared actor
+# backbone take them
+
+
+def filter_norms(weight):
+    # L1 norm of each output filter of a O x I x kh x kw conv weight
+    return weight.view(weight.size(0), -1).abs().sum(1).cpu().numpy()
+
+
+def channel_means(x):
+    # mean of each channel of a N x C x H x W batch, summed over the batch
+    return x.data.transpose(0, 1).contiguous().view(x.size(1), x.size(0), -1).mean(2).sum(1).cpu().numpy()
+
+
+def keep_channels(scores, ratio):
+    # ascending indices of the highest scores, ratio of them removed (at least one kept)
+    n = max(1, int(round(len(scores) * (1 - ratio))))
+    return np.sort(np.argsort(-scores, kind='mergesort')[:n])
+
+
+def critic_scores(model, criterion, batches=None):
+    #
+    # importance of each conv1 and conv2 output channel of model:
+    # 'magnitude' the L1 norm of its filter, 'activation' its mean ReLU
+    # output over the regions in batches (N x 3 x 107 x 107 each)
+    stages = [model.layers.conv1, model.layers.conv2]
+    if criterion == 'magnitude':
+        return [filter_norms(stage[0].weight.data) for stage in stages]
+    if batches is None:
+        batches = []
+    scores = [0, 0]
+    n = 0
+    for x in batches:
+        n += x.size(0)
+        for k, stage in enumerate(stages):
+            x = stage[1](stage[0](x))
+            scores[k] = scores[k] + channel_means(x)
+            for m in list(stage.children())[2:]:
+                x = m(x)
+    return [s / n for s in scores]
+
+
+def actor_scores(actor, criterion, batches=None):
+    #
+    # importance of each conv1-conv4 output channel of each branch of actor,
+    # {'l': [4 arrays], 'g': [4 arrays]}, as critic_scores; batches holds
+    # (xl, xg) pairs of local and global crops
+    if batches is None:
+        batches = []
+    scores = {}
+    for b in ['l', 'g']:
+        convs = [getattr(actor, 'conv%d_%s' % (k, b)) for k in range(1, 5)]
+        if criterion == 'magnitude':
+            scores[b] = [filter_norms(conv.weight.data) for conv in convs]
+            continue
+        scores[b] = [0, 0, 0, 0]
+        n = 0
+        for xl, xg in batches:
+            x = xl if b == 'l' else xg
+            n += x.size(0)
+            for k, conv in enumerate(convs):
+                x = F.relu(conv(x))
+                scores[b][k] = scores[b][k] + channel_means(x)
+                if k < 2:
+                    x = F.max_pool2d(actor.LRNl1(x), kernel_size=3, stride=2)
+        scores[b] = [s / n for s in scores[b]]
+    return scores
+
+
+def cut(arrays, name, dim, keep):
+    arrays[name] = arrays[name].index_select(dim, torch.from_numpy(keep))
+
+
+def prune_critic(model, keeps):
+    #
+    # conv1-fc5 weights of model, named as in MDNet, with only the conv1 and
+    # conv2 output channels in keeps (two index arrays)
+    arrays = OrderedDict([(name, p.data.cpu().clone()) for name, p in model.named_parameters()
+                          if name.startswith('layers.')])
+    for k, keep in enumerate(keeps):
+        cut(arrays, 'layers.conv%d.0.weight' % (k + 1), 0, keep)
+        cut(arrays, 'layers.conv%d.0.bias' % (k + 1), 0, keep)
+        cut(arrays, 'layers.conv%d.0.weight' % (k + 2), 1, keep)
+    return arrays
+
+
+def prune_actor(actor, keeps):
+    #
+    # weights of actor, named as in Actor, with only the conv1-conv4 output
+    # channels in keeps ({'l': [4 index arrays], 'g': [...]}, the same number
+    # of channels in both branches); fc1 takes the kept conv4 channels of
+    # the g branch, then those of the l branch
+    arrays = OrderedDict([(name, p.data.cpu().clone()) for name, p in actor.named_parameters()])
+    for b in ['l', 'g']:
+        for k, keep in enumerate(keeps[b]):
+            cut(arrays, 'conv%d_%s.weight' % (k + 1, b), 0, keep)
+            cut(arrays, 'conv%d_%s.bias' % (k + 1, b), 0, keep)
+            if k < 3:
+                cut(arrays, 'conv%d_%s.weight' % (k + 2, b), 1, keep)
+    c4 = actor.conv4_g.out_channels
+    cut(arrays, 'fc1.weight', 1, np.concatenate([keeps['g'][3], c4 + keeps['l'][3]]))
+    return arrays
@@ -0,0 +1,40 @@
+import copy
+
+import torch.nn as nn
+import torch
+
+try:
+    import torch.quantization as tq
+except ImportError:
+    tq = None
+
+
+def check_quantization():
+    if tq is None:
+        raise RuntimeError("INT8 inference needs torch.quantization (torch >= 1.3)")
+
+
+def quantize_linear(module):
+    #
+    # copy of module (a Linear or a container of them) with every nn.Linear
+    # replaced by a dynamic int8 Linear; float in, float out
+    return tq.quantize_dynamic(nn.Sequential(module), {nn.Linear}, dtype=torch.qint8)[0]
+
+
+def prepare_conv_relu(conv, relu):
+    #
+    # copy of conv followed by relu as one fused module with observers on its
+    # input and output; run calibration data through it, then convert_modules
+    # float in, float out
+    q = nn.Sequential(tq.QuantStub(), copy.deepcopy(conv), copy.deepcopy(relu), tq.DeQuantStub())
+    q.eval()
+    q = tq.fuse_modules(q, [['1', '2']])
+    q.qconfig = tq.QConfig(activation=tq.MinMaxObserver.with_args(reduce_range=True),
+                           weight=tq.default_per_channel_weight_observer)
+    tq.prepare(q, inplace=True)
+    return q
+
+
+def convert_modules(modules):
+    for q in modules:
+        tq.convert(q, inplace=True)
@@ -93,3 +93,47 @@ class SampleGenerator():
     def get_trans_f(self):
         return self.trans_f
 
+
+
+class MotionModel():
+    def __init__(self, bb, q=0.05, r=0.1):
+        #
+        # constant velocity Kalman filter on the target center (cx, cy, vx, vy)
+        # q, r: process and measurement noise std, relative to the target size
+        bb = np.array(bb, dtype='float64')
+        self.q = q
+        self.r = r
+        self.size = np.mean(bb[2:])
+
+        self.x = np.array([bb[0]+bb[2]/2, bb[1]+bb[3]/2, 0, 0])
+        self.P = np.diag([1, 1, 1, 1]) * (self.r * self.size) ** 2
+
+        self.F = np.eye(4)
+        self.F[0,2] = self.F[1,3] = 1
+        self.H = np.eye(2, 4)
+
+    def predict(self):
+        # piecewise constant acceleration noise
+        q = (self.q * self.size) ** 2
+        Q = q * np.kron(np.array([[0.25, 0.5], [0.5, 1]]), np.eye(2))
+        self.x = self.F.dot(self.x)
+        self.P = self.F.dot(self.P).dot(self.F.T) + Q
+        return self.x[:2]
+
+    def update(self, bb):
+        bb = np.array(bb, dtype='float64')
+        self.size = np.mean(bb[2:])
+        z = bb[:2] + bb[2:]/2
+        R = np.eye(2) * (self.r * self.size) ** 2
+
+        S = self.H.dot(self.P).dot(self.H.T) + R
+        K = self.P.dot(self.H.T).dot(np.linalg.inv(S))
+        self.x = self.x + K.dot(z - self.H.dot(self.x))
+        self.P = (np.eye(4) - K.dot(self.H)).dot(self.P)
+
+    def center(self):
+        return self.x[:2]
+
+    def sigma(self):
+        # std of the predicted center, in pixels
+        return np.sqrt(np.trace(self.P[:2,:2]) / 2)
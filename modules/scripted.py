@@ -0,0 +1,147 @@
+import os
+from collections import OrderedDict
+
+import torch.nn as nn
+import torch.nn.functional as F
+import torch
+
+from model import BinaryLoss
+
+# file of each exported entry point in an export directory
+SCRIPTED_FILES = OrderedDict([('backbone', 'critic_backbone.pt'),
+                              ('head', 'critic_head.pt'),
+                              ('step', 'critic_step.pt'),
+                              ('actor', 'actor.pt')])
+
+
+def check_jit():
+    if not hasattr(torch.jit, 'load'):
+        raise RuntimeError("TorchScript entry points need torch.jit.trace and torch.jit.load (torch >= 1.0)")
+
+
+class CriticBackbone(nn.Module):
+    # conv1-conv3 of an MDNet: N x 3 x H x W crops or regions -> conv3 maps
+    def __init__(self, model):
+        super(CriticBackbone, self).__init__()
+        self.conv1 = model.layers.conv1
+        self.conv2 = model.layers.conv2
+        self.conv3 = model.layers.conv3
+
+    def forward(self, x):
+        return self.conv3(self.conv2(self.conv1(x)))
+
+
+class CriticHead(nn.Module):
+    # eval mode fc4-fc6 of an MDNet: N x 4608 conv3 features -> fc4, fc5, fc6
+    def __init__(self, model, k=0):
+        super(CriticHead, self).__init__()
+        self.fc4 = model.layers.fc4
+        self.fc5 = model.layers.fc5
+        self.fc6 = model.branches[k]
+
+    def forward(self, x):
+        fc4 = self.fc4(x)
+        fc5 = self.fc5(fc4)
+        return fc4, fc5, self.fc6(fc5)
+
+
+class CriticStep(nn.Module):
+    #
+    # online training loss of fc4-fc6 (with dropout) on pos and neg conv3
+    # features; the weights are inputs rather than parameters, so gradients
+    # go to the tensors passed in, see MDNet.head_weights
+    def __init__(self, p=0.5):
+        super(CriticStep, self).__init__()
+        self.p = p
+        self.criterion = BinaryLoss()
+
+    def head(self, x, w4, b4, w5, b5, w6, b6):
+        x = F.relu(F.linear(F.dropout(x, self.p, True), w4, b4))
+        x = F.relu(F.linear(F.dropout(x, self.p, True), w5, b5))
+        return F.linear(F.dropout(x, self.p, True), w6, b6)
+
+    def forward(self, pos_feats, neg_feats, w4, b4, w5, b5, w6, b6):
+        pos_score = self.head(pos_feats, w4, b4, w5, b5, w6, b6)
+        neg_score = self.head(neg_feats, w4, b4, w5, b5, w6, b6)
+        return self.criterion(pos_score, neg_score)
+
+
+class ActorForward(nn.Module):
+    # unfused Actor forward from in_layer: xl, xg -> N x 3 box deltas
+    def __init__(self, actor, in_layer='conv1'):
+        super(ActorForward, self).__init__()
+        self.actor = actor
+        self.in_layer = in_layer
+
+    def forward(self, xl, xg):
+        return self.actor.forward_branches(xl, xg, self.in_layer)
+
+
+def trace_critic(model, crops):
+    #
+    # scripted backbone, head and training step of model, traced on crops
+    # (N x 3 x 107 x 107); they run on model's own parameters
+    check_jit()
+    training = model.training
+    model.eval()
+    scripted = {}
+    scripted['backbone'] = torch.jit.trace(CriticBackbone(model), crops)
+    feats = scripted['backbone'](crops)
+    feats = feats.reshape(feats.size(0), -1)
+    scripted['head'] = torch.jit.trace(CriticHead(model), feats)
+    # dropout makes the step nondeterministic, so it cannot be checked
+    scripted['step'] = torch.jit.trace(CriticStep(model.layers.fc4[0].p),
+                                       (feats, feats) + model.head_weights(), check_trace=False)
+    model.train(training)
+    return scripted
+
+
+def trace_actor(actor, xl, xg, in_layer='conv1'):
+    # scripted unfused forward of actor from in_layer, on actor's own parameters
+    check_jit()
+    return torch.jit.trace(ActorForward(actor, in_layer), (xl, xg))
+
+
+def save_scripted(scripted, path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for name, filename in SCRIPTED_FILES.iteritems():
+        torch.jit.save(scripted[name], os.path.join(path, filename))
+
+
+def load_scripted(path):
+    # entry points exported to path, None unless all of them are there
+    check_jit()
+    files = [os.path.join(path, filename) for filename in SCRIPTED_FILES.values()]
+    if not all([os.path.isfile(f) for f in files]):
+        return None
+    return dict([(name, torch.jit.load(f, map_location='cpu')) for name, f in zip(SCRIPTED_FILES, files)])
+
+
+def scripted_widths(scripted):
+    #
+    # conv widths of the exported critic and actor (see MDNet and Actor),
+    # read from their scripted parameters, so that a slim critic or a pruned
+    # actor gets eager models of its own shape to bind to
+    backbone = dict(scripted['backbone'].named_parameters())
+    actor = dict(scripted['actor'].named_parameters())
+    critic_widths = [backbone['conv%d.0.weight' % (k)].size(0) for k in range(1, 3)]
+    actor_widths = [actor['actor.conv%d_l.weight' % (k)].size(0) for k in range(1, 5)]
+    return critic_widths, actor_widths
+
+
+def bind_scripted(scripted, model, actor):
+    #
+    # makes loaded entry points run on the parameters of model and actor:
+    # the exported weights are copied into the eager parameters, which the
+    # scripted parameters then share, so that online updates of the eager
+    # models reach the scripted ones
+    wrappers = [(scripted['backbone'], CriticBackbone(model)),
+                (scripted['head'], CriticHead(model)),
+                (scripted['actor'], ActorForward(actor))]
+    for loaded, wrapper in wrappers:
+        params = dict(loaded.named_parameters())
+        for name, p in wrapper.named_parameters():
+            p.data.copy_(params[name].data)
+            params[name].data = p.data
+            params[name].requires_grad = p.requires_grad
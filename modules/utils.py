@@ -1,5 +1,7 @@
 from scipy.misc import imresize
 import numpy as np
+import cv2
+from PIL import Image
 
 def overlap_ratio(rect1, rect2):
     '''
@@ -64,3 +66,124 @@ def crop_image(img, bbox, img_size=107, padding=16, valid=False):
     
     scaled = imresize(cropped, (img_size, img_size))
     return scaled
+
+
+def crop_windows(bboxes, img_size=107, padding=16):
+    '''
+    Integer crop windows N x [min_x,min_y,max_x,max_y] of a batch of boxes,
+    rounded the same way as crop_image
+    '''
+
+    bboxes = np.asarray(bboxes, dtype='float32').reshape(-1, 4)
+
+    half = bboxes[:,2:] / 2
+    center = bboxes[:,:2] + half
+    if padding > 0:
+        half = half + padding * bboxes[:,2:] / img_size
+
+    min_xy = (center - half + 0.5).astype('int64')
+    max_xy = (center + half + 0.5).astype('int64')
+    return np.hstack([min_xy, max_xy])
+
+
+def resize_windows(img, windows, img_size=107, out=None):
+    '''
+    Resample a batch of crop windows to img_size x img_size in one call
+    - img: H x W x 3 uint8 image
+    - windows: N x [min_x,min_y,max_x,max_y], see crop_windows
+    - img_size: output size, or its (width, height)
+    - out: optional N x height x width x 3 buffer (uint8 or float32)
+           that the crops are written into
+    Windows that are not shrunk are stacked into one sampling grid and
+    resampled bilinearly by a single cv2.remap, pixels outside the image are
+    filled with 128. Windows shrunk in either direction need a filter as wide
+    as the shrink factor, which remap does not apply; they are resized one by
+    one with the bilinear filter of PIL, as in crop_image.
+    '''
+
+    if np.isscalar(img_size):
+        out_w, out_h = img_size, img_size
+    else:
+        out_w, out_h = img_size
+    n = windows.shape[0]
+    if out is None:
+        out = np.empty((n, out_h, out_w, 3), dtype='uint8')
+    if n == 0:
+        return out
+
+    size = windows[:,2:] - windows[:,:2]
+    shrunk = (size[:,0] > out_w) | (size[:,1] > out_h)
+    for i in np.where(shrunk)[0]:
+        cropped = Image.fromarray(window_pixels(img, windows[i]))
+        out[i] = np.asarray(cropped.resize((out_w, out_h), Image.BILINEAR))
+
+    idx = np.where(~shrunk)[0]
+    if len(idx) == n:
+        remap_windows(img, windows, out_w, out_h, out)
+    elif len(idx) > 0:
+        out[idx] = remap_windows(img, windows[idx], out_w, out_h)
+    return out
+
+
+def window_pixels(img, window):
+    # pixels of one integer window, filled with 128 outside the image
+    min_x, min_y, max_x, max_y = [int(v) for v in window]
+    img_h, img_w, _ = img.shape
+    if min_x >= 0 and min_y >= 0 and max_x <= img_w and max_y <= img_h:
+        return img[min_y:max_y, min_x:max_x, :]
+
+    min_x_val = max(0, min_x)
+    min_y_val = max(0, min_y)
+    max_x_val = min(img_w, max_x)
+    max_y_val = min(img_h, max_y)
+
+    cropped = 128 * np.ones((max_y-min_y, max_x-min_x, 3), dtype='uint8')
+    cropped[min_y_val-min_y:max_y_val-min_y, min_x_val-min_x:max_x_val-min_x, :] \
+        = img[min_y_val:max_y_val, min_x_val:max_x_val, :]
+    return cropped
+
+
+def remap_windows(img, windows, out_w, out_h, out=None):
+    # bilinear cv2.remap of all windows at once, see resize_windows
+    n = windows.shape[0]
+    if out is None:
+        out = np.empty((n, out_h, out_w, 3), dtype='uint8')
+
+    min_xy = windows[:,:2]
+    max_xy = windows[:,2:]
+    size = (max_xy - min_xy).astype('float32')
+
+    # output pixel centers mapped into each window, clamped to its border
+    xs = min_xy[:,0:1] + (np.arange(out_w, dtype='float32') + 0.5) / out_w * size[:,0:1] - 0.5
+    ys = min_xy[:,1:2] + (np.arange(out_h, dtype='float32') + 0.5) / out_h * size[:,1:2] - 0.5
+    xs = np.clip(xs, min_xy[:,0:1], np.maximum(max_xy[:,0:1] - 1, min_xy[:,0:1])).astype('float32')
+    ys = np.clip(ys, min_xy[:,1:2], np.maximum(max_xy[:,1:2] - 1, min_xy[:,1:2])).astype('float32')
+
+    # (k*out_h) x out_w grid with one block of rows per box, split so that it
+    # stays within the map size cv2.remap accepts
+    chunk = max(1, 32767 // out_h)
+    for start in range(0, n, chunk):
+        end = min(start + chunk, n)
+        k = end - start
+        map_x = np.broadcast_to(xs[start:end,None,:], (k, out_h, out_w)).reshape(k * out_h, out_w)
+        map_y = np.broadcast_to(ys[start:end,:,None], (k, out_h, out_w)).reshape(k * out_h, out_w)
+        if out.dtype == img.dtype:
+            dst = out[start:end].reshape(k * out_h, out_w, 3)
+        else:
+            dst = np.empty((k * out_h, out_w, 3), dtype=img.dtype)
+        cv2.remap(img, map_x, map_y, cv2.INTER_LINEAR, dst=dst,
+                  borderMode=cv2.BORDER_CONSTANT, borderValue=(128, 128, 128))
+        if out.dtype != img.dtype:
+            out[start:end] = dst.reshape(k, out_h, out_w, 3)
+    return out
+
+
+def crop_images(img, bboxes, img_size=107, padding=16, out=None):
+    '''
+    Crop and resize a batch of boxes in one vectorized call
+    - img: H x W x 3 uint8 image
+    - bboxes: N x [x,y,w,h], cropped with the same windows as crop_image
+    - out: optional N x img_size x img_size x 3 buffer (uint8 or float32)
+    '''
+
+    return resize_windows(img, crop_windows(bboxes, img_size, padding), img_size, out)
@@ -0,0 +1,53 @@
+import sys
+import time
+import argparse
+from torch.autograd import Variable
+import torch
+
+sys.path.insert(0, '../modules')
+from model import LRN
+
+
+def lrn_cat(x):
+    #
+    # previous LRN: five shifted copies of x^2 concatenated and summed
+    pad = Variable(x.data.new(x.size(0), 1, 1, x.size(2), x.size(3)).zero_())
+    x_sq = (x**2).unsqueeze(dim=1)
+    x_tile = torch.cat((torch.cat((x_sq,pad,pad,pad,pad),2),
+                        torch.cat((pad,x_sq,pad,pad,pad),2),
+                        torch.cat((pad,pad,x_sq,pad,pad),2),
+                        torch.cat((pad,pad,pad,x_sq,pad),2),
+                        torch.cat((pad,pad,pad,pad,x_sq),2)),1)
+    x_sumsq = x_tile.sum(dim=1).squeeze(dim=1)[:,2:-2,:,:]
+    x = x / ((2.+0.0001*x_sumsq)**0.75)
+    return x
+
+
+def bench(f, x, n):
+    f(x)
+    tic = time.time()
+    for _ in range(n):
+        f(x)
+    return (time.time() - tic) / n
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--batch', type=int, default=256, help='crops per batch')
+    parser.add_argument('-n', '--iters', type=int, default=20)
+    parser.add_argument('-g', '--gpu', action='store_true')
+    args = parser.parse_args()
+
+    lrn = LRN()
+    # conv1 and conv2 activations of 107x107 crops
+    for name, shape in [('conv1', (args.batch, 96, 51, 51)), ('conv2', (args.batch, 256, 11, 11)), ('conv1 x1', (1, 96, 51, 51))]:
+        x = torch.randn(*shape).abs() * 100
+        if args.gpu:
+            x = x.cuda()
+        x = Variable(x)
+        err = float((lrn(x) - lrn_cat(x)).abs().max().data.cpu().numpy())
+        t_cat = bench(lrn_cat, x, args.iters)
+        t_pool = bench(lrn, x, args.iters)
+        print "%-8s %-20s cat %7.2f ms, pool %7.2f ms, x%.1f, max abs diff %.2e" % \
+              (name, 'x'.join(map(str, shape)), t_cat * 1000, t_pool * 1000, t_cat / t_pool, err)
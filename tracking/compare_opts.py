@@ -0,0 +1,59 @@
+import ast
+import copy
+import argparse
+
+from run_tracker import *
+from run_tracker import _init_video, _compile_results
+
+
+def parse_variant(variant):
+    # 'key=value,key=value' -> dict of option overrides
+    overrides = OrderedDict()
+    for item in variant.split(','):
+        if not item:
+            continue
+        k, v = item.split('=', 1)
+        if k not in opts:
+            raise RuntimeError("Unknown option: %s" % (k))
+        overrides[k] = ast.literal_eval(v)
+    return overrides
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--seq', default='Car4', help='input seq')
+    parser.add_argument('-n', '--frames', type=int, default=0, help='first n frames only')
+    parser.add_argument('-o', '--opts', action='append', default=[],
+                        help='option overrides of one variant, e.g. shared_backbone=True')
+    args = parser.parse_args()
+
+    #
+    # precision and IoU compare variants only with the released weights on
+    # whole sequences; with other weights or the first few frames the table
+    # is a smoke test of the variants' code paths
+    img_path = '../dataset'
+    gt, frame_name_list, _, _ = _init_video(img_path, args.seq)
+    if args.frames > 0:
+        gt = gt[:args.frames]
+        frame_name_list = frame_name_list[:args.frames]
+
+    opts['show_train'] = 0
+    defaults = copy.deepcopy(opts)
+    rows = []
+    for variant in [''] + args.opts:
+        opts.update(copy.deepcopy(defaults))
+        opts.update(parse_variant(variant))
+        tic = time.time()
+        bboxes, result_bb, fps = run_ACT(frame_name_list, gt[0], gt=gt, display=0)
+        _, precision, precision_auc, iou = _compile_results(gt, result_bb, 20)
+        rows.append((variant or 'baseline', precision, iou, fps, time.time() - tic))
+
+    if args.frames > 0:
+        print "First %d frames of %s only: smoke test, not an accuracy comparison" % (args.frames, args.seq)
+    print '%-40s %9s %6s %7s %8s' % ('variant', 'precision', 'IOU', 'fps', 'total s')
+    base = rows[0]
+    for name, precision, iou, fps, total in rows:
+        print '%-40s %9.2f %6.2f %7.2f %8.1f' % (name, precision, iou, fps, total)
+        if name != base[0]:
+            print '%-40s %+9.2f %+6.2f %+7.2f' % ('  vs baseline', precision - base[1], iou - base[2], fps - base[3])
@@ -0,0 +1,28 @@
+import sys
+import time
+import argparse
+
+sys.path.insert(0, '../modules')
+from flat_weights import *
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('src', help='.pth, .mat or .npy weights')
+    parser.add_argument('dst', help='.flat file to write')
+    parser.add_argument('-t', '--target', default='critic', choices=['critic', 'actor', 'ddpg'],
+                        help='model the weights are for')
+    args = parser.parse_args()
+
+    arrays = convert_weights(args.src, args.dst, args.target)
+
+    # the flat file must give back the same arrays
+    tic = time.time()
+    tensors = load_flat(args.dst)
+    t_load = time.time() - tic
+    for name, a in arrays.iteritems():
+        a = a.cpu().numpy() if torch.is_tensor(a) else a
+        if not np.array_equal(tensors[name].numpy(), a):
+            raise RuntimeError("Mismatch of %s in %s" % (name, args.dst))
+    print "Wrote %d tensors to %s, mapped in %.2f ms" % (len(tensors), args.dst, t_load * 1000)
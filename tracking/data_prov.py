@@ -1,5 +1,8 @@
 import sys
+import Queue
+import threading
 import numpy as np
+import cv2
 from PIL import Image
 
 import torch
@@ -8,10 +11,188 @@ import torch.utils.data as data
 from utils import *
 
 
+class FrameCache():
+    def __init__(self, image, levels=0):
+        #
+        # one decoded frame shared by every consumer of the current iteration,
+        # with the forward_samples outputs of its crop windows memoized until
+        # release, which the tracker calls once it is done with the frame
+        # image is a PIL image or an HxWx3 uint8 array, which is used in place;
+        # consumers get a read-only view of it
+        # with levels > 0, crops are resampled from the coarsest of up to levels
+        # 2x downsampled copies of the frame that still covers img_size pixels
+
+        if isinstance(image, np.ndarray):
+            self.array = image.view()
+        else:
+            self.array = np.array(image)
+        self.array.flags.writeable = False
+        self.size = (self.array.shape[1], self.array.shape[0])
+        self.levels = levels
+        self.pyramid = [self.array]
+
+        # forward_samples outputs keyed on (extraction path, layer, crop window)
+        self.memo = {}
+        # (SearchRegion, conv3 map) that boxes inside it are pooled from
+        self.search = None
+        self.n_candidates = 0
+        self.n_scored = 0
+
+    def pop_stats(self):
+        # [candidates, scored candidates] since last call
+        stats = np.array([self.n_candidates, self.n_scored])
+        self.n_candidates = 0
+        self.n_scored = 0
+        return stats
+
+    def release(self):
+        # drops the memoized features; frames kept for online updates then
+        # only hold their pixels
+        self.memo.clear()
+
+    def level(self, k):
+        # pyramid level k, built from level k-1 on first use
+        while len(self.pyramid) <= k:
+            img = self.pyramid[-1]
+            h, w, _ = img.shape
+            img = cv2.resize(img, ((w + 1) // 2, (h + 1) // 2), interpolation=cv2.INTER_AREA)
+            img.flags.writeable = False
+            self.pyramid.append(img)
+        return self.pyramid[k]
+
+    def pick_level(self, shrink):
+        # coarsest level at which a region shrunk by shrink is not upsampled
+        if self.levels == 0 or shrink < 2:
+            return 0
+        return int(min(np.log2(shrink), self.levels))
+
+    def level_scale(self, k):
+        # x, y size of level k relative to the frame
+        h, w, _ = self.level(k).shape
+        return np.array([float(w) / self.size[0], float(h) / self.size[1]], dtype='float32')
+
+    def resize(self, windows, img_size=107, out=None):
+        if out is None:
+            out = np.empty((len(windows), img_size, img_size, 3), dtype='uint8')
+        if self.levels == 0:
+            return resize_windows(self.array, windows, img_size, out)
+
+        shrink = (windows[:,2:] - windows[:,:2]).min(1) / float(img_size)
+        ks = np.array([self.pick_level(r) for r in shrink], dtype='int')
+        for k in np.unique(ks):
+            idx = np.where(ks == k)[0]
+            img = self.level(k)
+            wins = windows[idx] * np.tile(self.level_scale(k), 2)
+            if len(idx) == len(windows):
+                resize_windows(img, wins, img_size, out)
+            else:
+                out[idx] = resize_windows(img, wins, img_size)
+        return out
+
+    def crop(self, bboxes, img_size=107, padding=16, out=None):
+        return self.resize(crop_windows(bboxes, img_size, padding), img_size, out)
+
+
+class FrameRing():
+    def __init__(self, levels=0):
+        #
+        # reusable uint8 frame buffers that frames are decoded into
+        # a buffer is handed out again only once the ring holds the last
+        # reference to it: every numpy view (FrameCache.array, slices of it,
+        # images handed to the display) references its base buffer, so frames
+        # kept for online updates and any view taken from a frame keep their
+        # buffer, and the ring only grows to the number of frames alive at once
+
+        self.levels = levels
+        self.buffers = []
+        self.pointer = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, shape):
+        # a buffer of shape referenced by nothing but the ring; the reference
+        # returned keeps it from being handed out twice
+        with self.lock:
+            n = len(self.buffers)
+            for j in range(n):
+                k = (self.pointer + j) % n
+                # the list's reference and getrefcount's argument
+                if self.buffers[k].shape == shape and sys.getrefcount(self.buffers[k]) == 2:
+                    break
+            else:
+                k = n
+                self.buffers.append(np.empty(shape, dtype='uint8'))
+            self.pointer = k + 1
+            return self.buffers[k]
+
+    def load(self, path):
+        bgr = cv2.imread(path, cv2.IMREAD_COLOR)
+        if bgr is None:
+            raise IOError("Cannot read image: %s" % (path))
+        buffer = self.acquire(bgr.shape)
+        cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=buffer)
+        return FrameCache(buffer, levels=self.levels)
+
+
+class FrameSource():
+    def __init__(self, img_list, depth=0, workers=1, levels=0):
+        #
+        # hands out the frames of img_list in order as FrameCache objects
+        # with depth > 0, worker threads decode up to depth frames ahead into
+        # bounded queues (frame i goes to queue i % workers)
+
+        self.img_list = img_list
+        self.ring = FrameRing(levels)
+        self.pointer = 0
+        self.workers = max(1, min(workers, depth)) if depth > 0 else 0
+
+        # queue depth seen by get, and how often it had to wait
+        self.n_gets = 0
+        self.n_waits = 0
+        self.depth_sum = 0
+
+        self.queues = []
+        for w in range(self.workers):
+            queue = Queue.Queue(maxsize=max(1, depth // self.workers))
+            thread = threading.Thread(target=self.decode, args=(w, queue))
+            thread.daemon = True
+            thread.start()
+            self.queues.append(queue)
+
+    def load(self, i):
+        return self.ring.load(self.img_list[i])
+
+    def decode(self, w, queue):
+        for i in range(w, len(self.img_list), self.workers):
+            try:
+                frame = self.load(i)
+            except Exception as e:
+                frame = e
+            queue.put(frame)
+
+    def get(self):
+        i = self.pointer
+        self.pointer += 1
+        if not self.workers:
+            return self.load(i)
+
+        queue = self.queues[i % self.workers]
+        self.n_gets += 1
+        self.depth_sum += sum([q.qsize() for q in self.queues])
+        if queue.empty():
+            self.n_waits += 1
+        frame = queue.get()
+        if isinstance(frame, Exception):
+            raise frame
+        return frame
+
+
 class RegionExtractor():
     def __init__(self, image, samples, crop_size, padding, batch_size, shuffle=False):
 
-        self.image = np.asarray(image)
+        if not isinstance(image, FrameCache):
+            image = FrameCache(image)
+        self.frame = image
+        self.image = image.array
         self.samples = samples
         self.crop_size = crop_size
         self.padding = padding
@@ -20,8 +201,7 @@ class RegionExtractor():
 
         self.index = np.arange(len(samples))
         self.pointer = 0
-
-        self.mean = self.image.mean(0).mean(0).astype('float32')
+        self.buffer = np.empty((min(batch_size, len(samples)), crop_size, crop_size, 3), dtype='float32')
 
     def __iter__(self):
         return self
@@ -41,10 +221,86 @@ class RegionExtractor():
     next = __next__
 
     def extract_regions(self, index):
-        regions = np.zeros((len(index),self.crop_size,self.crop_size,3),dtype='uint8')
-        for i, sample in enumerate(self.samples[index]):
-            regions[i] = crop_image(self.image, sample, self.crop_size, self.padding)
+        regions = self.frame.crop(self.samples[index], self.crop_size, self.padding,
+                                  out=self.buffer[:len(index)])
 
-        regions = regions.transpose(0,3,1,2).astype('float32')
+        regions = regions.transpose(0,3,1,2)
         regions = regions - 128.
         return regions
+
+
+class SearchRegion():
+    def __init__(self, image, samples, crop_size, padding, max_size, zoom=1.):
+        #
+        # one window covering the padded crops of all samples, resized so that
+        # a sample of the mean size maps to crop_size * zoom pixels
+
+        frame = None
+        if isinstance(image, FrameCache):
+            frame = image
+            image = image.array
+        image = np.asarray(image)
+        self.crop_size = crop_size
+        self.padding = padding
+        self.zoom = zoom
+        wins = self.padded_windows(samples)
+
+        min_xy = np.floor(wins[:,:2].min(0))
+        max_xy = np.ceil((wins[:,:2] + wins[:,2:]).max(0))
+        scale = crop_size * zoom / wins[:,2:].mean(0)
+        out_w, out_h = np.maximum(np.round((max_xy - min_xy) * scale), crop_size).astype('int')
+
+        self.region = None
+        self.crops = None
+        self.origin = None
+        self.scale = None
+        if max(out_w, out_h) > max_size:
+            return
+
+        # cut from the coarsest pyramid level that is still shrunk, with the
+        # region bounds snapped to that level's pixels
+        level_scale = np.ones(2, dtype='float32')
+        if frame is not None:
+            k = frame.pick_level(((max_xy - min_xy) / [out_w, out_h]).min())
+            image = frame.level(k)
+            level_scale = frame.level_scale(k)
+        min_x, min_y = np.floor(min_xy * level_scale).astype('int')
+        max_x, max_y = np.ceil(max_xy * level_scale).astype('int')
+        min_xy = np.array([min_x, min_y]) / level_scale
+        max_xy = np.array([max_x, max_y]) / level_scale
+
+        window = np.array([[min_x, min_y, max_x, max_y]])
+        region = resize_windows(image, window, (out_w, out_h))[0]
+        region = region.transpose(2,0,1)[None].astype('float32') - 128.
+        self.region = torch.from_numpy(region)
+
+        # sample windows in resized region pixels
+        self.size = np.array([out_w, out_h], dtype='float32')
+        self.origin = min_xy.astype('float32')
+        self.scale = (self.size / (max_xy - min_xy)).astype('float32')
+        self.crops = self.map_windows(samples)
+
+    def padded_windows(self, samples):
+        # padded crop windows [x,y,w,h], as in crop_image
+        samples = np.asarray(samples, dtype='float32').reshape(-1, 4)
+        pad = 1 + 2. * self.padding / self.crop_size
+        wins = np.copy(samples)
+        wins[:,:2] += samples[:,2:] / 2 * (1 - pad)
+        wins[:,2:] *= pad
+        return wins
+
+    def map_windows(self, samples):
+        # padded crop windows of any samples in resized region pixels
+        wins = self.padded_windows(samples)
+        return np.hstack([(wins[:,:2] - self.origin) * self.scale, wins[:,2:] * self.scale]).astype('float32')
+
+    def contains(self, crops):
+        # whether all crops (from map_windows) lie inside the region
+        return self.region is not None and (crops[:,:2] >= 0).all() and \
+            (crops[:,:2] + crops[:,2:] <= self.size).all()
+
+    def fits(self, crops, ratio):
+        # whether all crops (from map_windows) are resampled to within ratio
+        # of crop_size * zoom
+        size = crops[:,2:] / (self.crop_size * self.zoom)
+        return (size <= ratio).all() and (size >= 1. / ratio).all()
@@ -0,0 +1,147 @@
+import copy
+import argparse
+
+from run_tracker import *
+from run_tracker import _init_video, _compile_results, _success_auc
+
+
+def sample_crops(seqs, frame_step, first, n_samples):
+    #
+    # uint8 global and local crops (N x 107 x 107 x 3 each) of n_samples boxes
+    # around the ground truth of every frame_step-th frame of seqs from first
+    # on: half as init_actor draws its adaptation samples, half spread wider,
+    # like the previous frame's box after a fast motion
+    crops_g, crops_l = [], []
+    for seq in seqs:
+        gt, img_list, _, _ = _init_video('../dataset', seq)
+        for i in range(first, len(img_list), frame_step):
+            frame = FrameCache(cv2.cvtColor(cv2.imread(img_list[i], cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB))
+            samples = np.concatenate([
+                gen_samples(SampleGenerator('uniform', frame.size, 0.3, 1.5, None),
+                            gt[i], n_samples // 2, [0.6, 1], [0.9, 1.1]),
+                gen_samples(SampleGenerator('uniform', frame.size, 0.6, 1.5, None),
+                            gt[i], n_samples - n_samples // 2, [0.3, 1], [0.8, 1.2])])
+            samples = np.round(samples)
+            crops_g.append(frame.crop(samples, 107, 107 / 2.))
+            crops_l.append(frame.crop(samples, 107, 0))
+    return np.concatenate(crops_g), np.concatenate(crops_l)
+
+
+def to_batch(crops):
+    return to_input(torch.from_numpy(crops.transpose(0, 3, 1, 2).astype('float32') - 128.))
+
+
+def actor_outputs(actor, crops_g, crops_l, batch_size=64):
+    # eval mode outputs of actor on the crops, N x 3 array
+    actor.eval()
+    outputs = []
+    for k in range(0, len(crops_g), batch_size):
+        out = actor(to_batch(crops_l[k:k + batch_size]), to_batch(crops_g[k:k + batch_size]))
+        outputs.append(out.data.cpu().numpy())
+    return np.concatenate(outputs)
+
+
+def distill(student, crops_g, crops_l, targets, n_epochs, batch_size, lr):
+    #
+    # trains student to reproduce targets (the teacher's outputs on the
+    # crops) with an MSE loss; the learning rate drops 10x for the last third
+    optimizer = optim.Adam(student.parameters(), lr=lr)
+    loss_func = nn.MSELoss()
+    student.train()
+    for epoch in range(n_epochs):
+        if epoch == n_epochs * 2 // 3:
+            for group in optimizer.param_groups:
+                group['lr'] = lr * 0.1
+        idx = np.random.permutation(len(crops_g))
+        total = 0.
+        for k in range(0, len(idx), batch_size):
+            cur_idx = idx[k:k + batch_size]
+            out = student(to_batch(crops_l[cur_idx]), to_batch(crops_g[cur_idx]))
+            loss = loss_func(out, to_input(torch.from_numpy(targets[cur_idx])))
+            student.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += float(loss.data.cpu().numpy()) * len(cur_idx)
+        print "Epoch %d, Loss %.6f" % (epoch, total / len(idx))
+    student.eval()
+
+
+def latency(actor, n_runs=50):
+    # median eval mode time in ms of one box (batch of 1)
+    actor.eval()
+    crops = to_input(torch.zeros(1, 3, 107, 107))
+    times = []
+    for k in range(n_runs + 5):
+        tic = time.time()
+        actor(crops, crops)
+        times.append(time.time() - tic)
+    return np.median(times[5:]) * 1000
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--seq', action='append', default=[], help='training seq')
+    parser.add_argument('-o', '--out', default='../models/actor_lite.flat', help='.flat file to write')
+    parser.add_argument('-w', '--widths', default='32,64,128,128', help='conv1-conv4 widths of the student')
+    parser.add_argument('--step', type=int, default=4, help='train on every step-th frame')
+    parser.add_argument('--samples', type=int, default=64, help='boxes per frame')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch', type=int, default=64)
+    parser.add_argument('--lr', type=float, default=0.001)
+    parser.add_argument('-r', '--report', action='store_true',
+                        help='compare latency and tracking accuracy of teacher and student')
+    parser.add_argument('-n', '--frames', type=int, default=0, help='track the first n frames only')
+    args = parser.parse_args()
+    seqs = args.seq or ['Car4']
+
+    opts['show_train'] = 0
+    teacher = Actor(opts['actor_path'])
+    student = LiteActor(widths=[int(w) for w in args.widths.split(',')])
+    if opts['use_gpu']:
+        teacher = teacher.cuda()
+        student = student.cuda()
+
+    crops_g, crops_l = sample_crops(seqs, args.step, 0, args.samples)
+    print "Distilling on %d crops" % (len(crops_g))
+    targets = actor_outputs(teacher, crops_g, crops_l)
+    distill(student, crops_g, crops_l, targets, args.epochs, args.batch, args.lr)
+    save_flat(OrderedDict([(name, p.data) for name, p in student.named_parameters()]), args.out)
+
+    # the file must give back the same student
+    loaded = LiteActor(args.out)
+    if opts['use_gpu']:
+        loaded = loaded.cuda()
+    if not np.array_equal(actor_outputs(loaded, crops_g[:8], crops_l[:8]), actor_outputs(student, crops_g[:8], crops_l[:8])):
+        raise RuntimeError("Mismatch of the student in %s" % (args.out))
+    print "Wrote %s" % (args.out)
+
+    if not args.report:
+        sys.exit(0)
+
+    # held out: the frames halfway between the training frames
+    test_g, test_l = sample_crops(seqs, args.step, args.step // 2, args.samples // 4)
+    err = np.abs(actor_outputs(student, test_g, test_l) - actor_outputs(teacher, test_g, test_l)).mean(0)
+
+    n_params = [sum([p.numel() for p in a.parameters()]) for a in [teacher, student]]
+    fused = Actor(opts['actor_path'], True)
+    fused.eval()
+    print '%-10s %10s %11s' % ('actor', 'params', 'latency ms')
+    print '%-10s %10d %11.2f' % ('teacher', n_params[0], latency(teacher))
+    print '%-10s %10s %11.2f' % ('  fused', '', latency(fused))
+    print '%-10s %10d %11.2f' % ('student', n_params[1], latency(student))
+    print 'held out mean abs error of dx, dy, ds: %.4f %.4f %.4f' % tuple(err)
+
+    defaults = copy.deepcopy(opts)
+    print '%-10s %-8s %9s %6s %6s %7s' % ('seq', 'actor', 'precision', 'AUC', 'IOU', 'fps')
+    for seq in seqs:
+        gt, img_list, _, _ = _init_video('../dataset', seq)
+        if args.frames > 0:
+            gt = gt[:args.frames]
+            img_list = img_list[:args.frames]
+        for name, lite_path in [('teacher', None), ('student', args.out)]:
+            opts.update(copy.deepcopy(defaults))
+            opts['lite_actor_path'] = lite_path
+            bboxes, result_bb, fps = run_ACT(img_list, gt[0], gt=gt, display=0)
+            _, precision, _, iou = _compile_results(gt, result_bb, 20)
+            print '%-10s %-8s %9.2f %6.2f %6.2f %7.2f' % (seq, name, precision, _success_auc(gt, result_bb), iou, fps)
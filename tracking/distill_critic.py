@@ -0,0 +1,154 @@
+import copy
+import argparse
+
+from run_tracker import *
+from run_tracker import _init_video, _compile_results, _success_auc
+
+
+def sample_regions(seqs, frame_step, first, n_samples):
+    #
+    # uint8 critic regions (N x 107 x 107 x 3) of n_samples boxes of every
+    # frame_step-th frame of seqs from first on, drawn like the samples the
+    # critic scores: a quarter around the target (pos, bbreg), the rest
+    # elsewhere in the frame (neg, redetection)
+    regions = []
+    for seq in seqs:
+        gt, img_list, _, _ = _init_video('../dataset', seq)
+        for i in range(first, len(img_list), frame_step):
+            frame = FrameCache(cv2.cvtColor(cv2.imread(img_list[i], cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB))
+            n_pos = n_samples // 4
+            samples = np.concatenate([
+                gen_samples(SampleGenerator('gaussian', frame.size, 0.1, 1.2), gt[i], n_pos, [0.6, 1]),
+                gen_samples(SampleGenerator('uniform', frame.size, 1, 2, 1.1), gt[i], (n_samples - n_pos) // 2),
+                gen_samples(SampleGenerator('whole', frame.size, 0, 1.2, 1.1), gt[i],
+                            n_samples - n_pos - (n_samples - n_pos) // 2)])
+            regions.append(frame.crop(samples, opts['img_size'], opts['padding']))
+    return np.concatenate(regions)
+
+
+def to_batch(regions):
+    return to_input(torch.from_numpy(regions.transpose(0, 3, 1, 2).astype('float32') - 128.))
+
+
+def critic_features(model, regions, out_layer='conv3', batch_size=256):
+    # eval mode out_layer features of model on the regions, N x D array
+    model.eval()
+    feats = []
+    for k in range(0, len(regions), batch_size):
+        feats.append(model(to_batch(regions[k:k + batch_size]), out_layer=out_layer).data.cpu().numpy())
+    return np.concatenate(feats)
+
+
+def distill(student, regions, targets, n_epochs, batch_size, lr):
+    #
+    # trains conv1-conv3 of student to reproduce targets (the teacher's conv3
+    # features of the regions) with an MSE loss; the learning rate drops 10x
+    # for the last third
+    params = [p for name, p in student.layers.named_parameters() if name.startswith('conv')]
+    optimizer = optim.Adam(params, lr=lr)
+    loss_func = nn.MSELoss()
+    student.train()
+    for epoch in range(n_epochs):
+        if epoch == n_epochs * 2 // 3:
+            for group in optimizer.param_groups:
+                group['lr'] = lr * 0.1
+        idx = np.random.permutation(len(regions))
+        total = 0.
+        for k in range(0, len(idx), batch_size):
+            cur_idx = idx[k:k + batch_size]
+            feats = student(to_batch(regions[cur_idx]), out_layer='conv3')
+            loss = loss_func(feats, to_input(torch.from_numpy(targets[cur_idx])))
+            student.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += float(loss.data.cpu().numpy()) * len(cur_idx)
+        print "Epoch %d, Loss %.6f" % (epoch, total / len(idx))
+    student.eval()
+
+
+def latency(model, n_boxes, n_runs=20):
+    # median eval mode time in ms of scoring n_boxes regions (conv1-fc6)
+    model.eval()
+    regions = to_input(torch.zeros(n_boxes, 3, opts['img_size'], opts['img_size']))
+    times = []
+    for k in range(n_runs + 2):
+        tic = time.time()
+        model(regions)
+        times.append(time.time() - tic)
+    return np.median(times[2:]) * 1000
+
+
+def rel_error(feats, targets):
+    # mean squared error relative to the mean square of targets
+    return np.mean((feats - targets) ** 2) / np.mean(targets ** 2)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--seq', action='append', default=[], help='training seq')
+    parser.add_argument('-o', '--out', default='../models/critic_lite.flat', help='.flat file to write')
+    parser.add_argument('-w', '--widths', default='48,128', help='conv1 and conv2 widths of the student')
+    parser.add_argument('--step', type=int, default=4, help='train on every step-th frame')
+    parser.add_argument('--samples', type=int, default=64, help='regions per frame')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch', type=int, default=64)
+    parser.add_argument('--lr', type=float, default=0.001)
+    parser.add_argument('-r', '--report', action='store_true',
+                        help='compare speed and tracking accuracy of teacher and student')
+    parser.add_argument('-n', '--frames', type=int, default=0, help='track the first n frames only')
+    args = parser.parse_args()
+    seqs = args.seq or ['Car4']
+
+    opts['show_train'] = 0
+    teacher = MDNet(opts['model_path'])
+    student = MDNet(widths=[int(w) for w in args.widths.split(',')])
+    # the student keeps the teacher's fc4-fc5, trained on the features it learns to reproduce
+    student.layers.fc4.load_state_dict(teacher.layers.fc4.state_dict())
+    student.layers.fc5.load_state_dict(teacher.layers.fc5.state_dict())
+    if opts['use_gpu']:
+        teacher = teacher.cuda()
+        student = student.cuda()
+
+    regions = sample_regions(seqs, args.step, 0, args.samples)
+    print "Distilling on %d regions" % (len(regions))
+    targets = critic_features(teacher, regions)
+    distill(student, regions, targets, args.epochs, args.batch, args.lr)
+    save_flat(OrderedDict([(name, p.data) for name, p in student.named_parameters() if name.startswith('layers.')]),
+              args.out)
+
+    # the file must give back the same student
+    loaded = MDNet(args.out)
+    if opts['use_gpu']:
+        loaded = loaded.cuda()
+    if not np.array_equal(critic_features(loaded, regions[:8], 'fc5'), critic_features(student, regions[:8], 'fc5')):
+        raise RuntimeError("Mismatch of the student in %s" % (args.out))
+    print "Wrote %s" % (args.out)
+
+    if not args.report:
+        sys.exit(0)
+
+    # held out: the frames halfway between the training frames
+    test = sample_regions(seqs, args.step, args.step // 2, args.samples // 4)
+    err = [rel_error(critic_features(student, test, l), critic_features(teacher, test, l)) for l in ['conv3', 'fc5']]
+
+    n_params = [sum([p.numel() for name, p in m.layers.named_parameters() if name.startswith('conv')])
+                for m in [teacher, student]]
+    print '%-10s %10s %11s %13s' % ('critic', 'conv params', '1 box ms', '%d boxes ms' % (opts['batch_test']))
+    for name, m, n in [('teacher', teacher, n_params[0]), ('student', student, n_params[1])]:
+        print '%-10s %10d %11.2f %13.1f' % (name, n, latency(m, 1), latency(m, opts['batch_test']))
+    print 'held out relative squared error of conv3, fc5: %.4f %.4f' % tuple(err)
+
+    defaults = copy.deepcopy(opts)
+    print '%-10s %-8s %9s %6s %6s %7s' % ('seq', 'critic', 'precision', 'AUC', 'IOU', 'fps')
+    for seq in seqs:
+        gt, img_list, _, _ = _init_video('../dataset', seq)
+        if args.frames > 0:
+            gt = gt[:args.frames]
+            img_list = img_list[:args.frames]
+        for name, lite_path in [('teacher', None), ('student', args.out)]:
+            opts.update(copy.deepcopy(defaults))
+            opts['lite_model_path'] = lite_path
+            bboxes, result_bb, fps = run_ACT(img_list, gt[0], gt=gt, display=0)
+            _, precision, _, iou = _compile_results(gt, result_bb, 20)
+            print '%-10s %-8s %9.2f %6.2f %6.2f %7.2f' % (seq, name, precision, _success_auc(gt, result_bb), iou, fps)
@@ -0,0 +1,22 @@
+import argparse
+
+from run_tracker import *
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--out', default='../models/jit', help='export directory')
+    parser.add_argument('-m', '--model', default=opts['model_path'], help='critic weights')
+    parser.add_argument('-a', '--actor', default=opts['actor_path'], help='actor weights')
+    args = parser.parse_args()
+
+    # traced on the CPU from the unfused float models; tracking with jit_path
+    # set to the export directory loads them instead of the weight files
+    model = MDNet(args.model)
+    actor = Actor(args.actor)
+    crops = torch.zeros(1, 3, opts['img_size'], opts['img_size'])
+    scripted = trace_critic(model, crops)
+    scripted['actor'] = trace_actor(actor, crops, crops)
+    save_scripted(scripted, args.out)
+    print "Exported %s to %s" % (', '.join(SCRIPTED_FILES.values()), args.out)
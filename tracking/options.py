@@ -3,13 +3,75 @@ from collections import OrderedDict
 opts = OrderedDict()
 opts['use_gpu'] = True
 
+# either may be a .flat file written by convert_weights.py, which is mapped
+# into memory instead of being read
 opts['model_path'] = '../models/critic.pth'
 opts['actor_path'] = '../models/Actor250000.npy'
+# run the actor's local and global branches as groups=2 convolutions
+opts['actor_fused'] = False
+# init_actor adapts only the actor's fc1-fc2 and leaves its conv layers as
+# loaded, so that conv weights mapped from a .flat file are never written and
+# stay shared with the other processes mapping them (set by run_pool.py)
+opts['actor_fc_only'] = False
+# run the actor's local branch on the critic's frozen conv1-conv3, with the
+# actor's local features and the verification of its box pooled from one conv3
+# map of the region around the box, moved by up to shared_margin of its size;
+# init_actor then only adapts the actor layers above conv3, on local features
+# pooled the same way from one region holding its samples (not combined with
+# pipeline_actor, whose thread would run the critic while it trains)
+opts['shared_backbone'] = False
+opts['shared_margin'] = 0.2
+# a LiteActor .flat file written by distill_actor.py, run in place of the
+# actor at actor_path (None: the VGG-M actor); not combined with
+# shared_backbone or with the actor exported to jit_path
+opts['lite_actor_path'] = None
+# a slim critic .flat file written by distill_critic.py, loaded in place of
+# model_path (None: the VGG-M critic); its conv1-conv2 are narrower, its
+# conv3 features and fc4-fc6 the same shape (not combined with jit_path)
+opts['lite_model_path'] = None
+
+# CPU only int8 inference copies of the critic and the actor, made after the
+# first frame training: 'fc' quantizes the fc layers dynamically, 'all' also
+# the conv layers, calibrated on quantize_calib first frame crops; the float
+# fc4-fc6 are still what online updates train, and their int8 copy is rebuilt
+# at the end of every train() call (None: float only)
+opts['quantize'] = None
+opts['quantize_calib'] = 128
+
+# CPU execution profile (use_gpu False): cpu_threads intra-op and
+# cpu_interop_threads inter-op threads (0: torch default), every thread of the
+# tracker process pinned to the cores in cpu_affinity (None: not pinned) and
+# the ReLUs of the critic and the actor applied in place; give each tracker
+# process its own cores
+opts['cpu_profile'] = False
+opts['cpu_threads'] = 0
+opts['cpu_interop_threads'] = 0
+opts['cpu_affinity'] = None
+opts['inplace_relu'] = True
+
+# run the critic's conv1-conv3 and fc4-fc6, its online training step and the
+# actor as TorchScript modules (torch >= 1.0), traced from the loaded models
+# (jit) or loaded with their weights from jit_path, a directory written by
+# export_jit.py, when it holds all of them (model_path and actor_path are then
+# not read, the critic and actor widths are those of the export); the eager
+# models keep the parameters that the scripted modules run on
+opts['jit'] = False
+opts['jit_path'] = None
 
 
 opts['img_size'] = 107
 opts['padding'] = 16
 
+# score candidates on conv3 maps of search regions instead of one crop per
+# box, one region per group of boxes whose widths and heights lie within
+# roi_scale_ratio of each other, so that every box is resampled to within
+# that ratio of img_size (a group whose region would be larger than
+# roi_max_size pixels is cropped); boxes are pooled from a conv3 map the
+# frame shares only under the same ratio
+opts['roi_align'] = False
+opts['roi_max_size'] = 1024
+opts['roi_scale_ratio'] = 1.25
+
 opts['batch_pos'] = 32
 opts['batch_neg'] = 96
 opts['batch_neg_cand'] = 1024
@@ -20,6 +82,46 @@ opts['trans_f'] = 0.6
 opts['scale_f'] = 1.05
 opts['trans_f_expand'] = 1.2
 
+# redetect with a dense fc4-fc6 score map at a few scales instead of samples
+opts['dense_search'] = False
+opts['dense_scales'] = [-1, 0, 1]
+
+# prefilter redetection samples on a low resolution shared conv3 map and
+# pass only the best fraction to the full critic
+opts['cascade'] = False
+opts['cascade_keep'] = 0.1
+opts['cascade_zoom'] = 0.5
+
+# size the redetection search and sample budget from a constant velocity
+# motion model while the target is being tracked
+opts['motion_model'] = False
+opts['motion_q'] = 0.05
+opts['motion_r'] = 0.1
+opts['trans_f_min'] = 0.2
+opts['n_samples_min'] = 32
+
+# keep the previous box without running the networks while the 2x window
+# around the target changes less than static_thr (mean abs difference of a
+# static_size thumbnail), for at most static_max_skip frames in a row
+opts['static_gate'] = False
+opts['static_size'] = 32
+opts['static_thr'] = 2.0
+opts['static_max_skip'] = 10
+
+# load frame i+1 and run the actor on it from the actor's box of frame i while
+# the critic is still verifying that box; the result is dropped if the box is
+# rejected
+opts['pipeline_actor'] = False
+
+# decode up to prefetch frames ahead on prefetch_workers threads (0: decode
+# each frame when it is needed)
+opts['prefetch'] = 0
+opts['prefetch_workers'] = 2
+
+# serve crops and search regions of large targets from up to pyramid_levels
+# 2x downsampled copies of each frame, built on first use (0: full frame only)
+opts['pyramid_levels'] = 0
+
 opts['n_bbreg'] = 1000
 opts['overlap_bbreg'] = [0.6, 1]
 opts['scale_bbreg'] = [1, 2]
@@ -31,6 +133,13 @@ opts['n_neg_init'] = 5000
 opts['overlap_pos_init'] = [0.7, 1]
 opts['overlap_neg_init'] = [0, 0.5]
 
+# run the online updates of fc4-fc6, with the conv3 feature extraction of the
+# frames they learn from, on a background thread and a copy of the critic,
+# whose trained weights replace the tracked ones at the start of the first
+# frame after the update is done; frames until then are scored with the
+# previous weights, and an update requested while one runs waits for it (a
+# newer request replaces a waiting one)
+opts['update_async'] = False
 opts['lr_update'] = 0.0002
 opts['maxiter_update'] = 15
 opts['n_pos_update'] = 50
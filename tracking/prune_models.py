@@ -0,0 +1,102 @@
+import copy
+import argparse
+
+from run_tracker import *
+from run_tracker import _init_video, _compile_results, _success_auc
+import distill_actor
+import distill_critic
+from prune import *
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t', '--target', default='both', choices=['critic', 'actor', 'both'],
+                        help='model(s) to prune')
+    parser.add_argument('-c', '--criterion', default='magnitude', choices=['magnitude', 'activation'],
+                        help='channel ranking: filter L1 norm or mean activation on sample crops')
+    parser.add_argument('-r', '--ratio', type=float, action='append', default=[],
+                        help='fraction of the channels of each layer to remove, one model per ratio')
+    parser.add_argument('-o', '--out', default='../models/pruned', help='directory of the .flat files')
+    parser.add_argument('-s', '--seq', action='append', default=[],
+                        help='seq for the activation statistics and the table')
+    parser.add_argument('--step', type=int, default=8, help='activation statistics of every step-th frame')
+    parser.add_argument('--samples', type=int, default=16, help='boxes per frame')
+    parser.add_argument('-n', '--frames', type=int, default=0, help='track the first n frames only')
+    parser.add_argument('--no-eval', action='store_true', help='only write the pruned models')
+    args = parser.parse_args()
+    ratios = args.ratio or [0.25, 0.5]
+    seqs = args.seq or ['Car4']
+    targets = ['critic', 'actor'] if args.target == 'both' else [args.target]
+
+    opts['show_train'] = 0
+    model = MDNet(opts['model_path'])
+    actor = Actor(opts['actor_path'])
+    model.eval()
+    actor.eval()
+    if opts['use_gpu']:
+        model = model.cuda()
+        actor = actor.cuda()
+
+    # activation statistics on batches of 64 crops sampled as for distillation
+    scores = {}
+    if 'critic' in targets:
+        batches = []
+        if args.criterion == 'activation':
+            regions = distill_critic.sample_regions(seqs, args.step, 0, args.samples)
+            batches = [distill_critic.to_batch(regions[k:k + 64]) for k in range(0, len(regions), 64)]
+        scores['critic'] = critic_scores(model, args.criterion, batches)
+    if 'actor' in targets:
+        batches = []
+        if args.criterion == 'activation':
+            crops_g, crops_l = distill_actor.sample_crops(seqs, args.step, 0, args.samples)
+            batches = [(distill_actor.to_batch(crops_l[k:k + 64]), distill_actor.to_batch(crops_g[k:k + 64]))
+                       for k in range(0, len(crops_g), 64)]
+        scores['actor'] = actor_scores(actor, args.criterion, batches)
+
+    if not os.path.isdir(args.out):
+        os.makedirs(args.out)
+    # ratio 0 is written the same way, so that the first row of the table
+    # differs from the others only in the removed channels
+    variants = []
+    for ratio in [0.] + ratios:
+        paths = {}
+        if 'critic' in targets:
+            keeps = [keep_channels(s, ratio) for s in scores['critic']]
+            paths['model_path'] = os.path.join(args.out, 'critic_p%02d.flat' % (round(ratio * 100)))
+            save_flat(prune_critic(model, keeps), paths['model_path'])
+        if 'actor' in targets:
+            keeps = dict([(b, [keep_channels(s, ratio) for s in scores['actor'][b]]) for b in ['l', 'g']])
+            paths['actor_path'] = os.path.join(args.out, 'actor_p%02d.flat' % (round(ratio * 100)))
+            save_flat(prune_actor(actor, keeps), paths['actor_path'])
+        print "Pruned %d%%: %s" % (round(ratio * 100), ', '.join(paths.values()))
+        variants.append((ratio, paths))
+
+    if args.no_eval:
+        sys.exit(0)
+
+    defaults = copy.deepcopy(opts)
+    print '%-6s %-10s %11s %10s %9s %9s %6s %6s %7s' % \
+          ('pruned', 'seq', 'critic ms', 'actor ms', 'params', 'precision', 'AUC', 'IOU', 'fps')
+    for ratio, paths in variants:
+        opts.update(copy.deepcopy(defaults))
+        opts.update(paths)
+        pruned_model = MDNet(opts['model_path'])
+        pruned_actor = Actor(opts['actor_path'])
+        if opts['use_gpu']:
+            pruned_model = pruned_model.cuda()
+            pruned_actor = pruned_actor.cuda()
+        n_params = sum([p.numel() for p in pruned_model.parameters()] + [p.numel() for p in pruned_actor.parameters()])
+        # critic: one redetection batch of batch_test boxes, actor: one box
+        t_critic = distill_critic.latency(pruned_model, opts['batch_test'])
+        t_actor = distill_actor.latency(pruned_actor)
+        for seq in seqs:
+            gt, img_list, _, _ = _init_video('../dataset', seq)
+            if args.frames > 0:
+                gt = gt[:args.frames]
+                img_list = img_list[:args.frames]
+            bboxes, result_bb, fps = run_ACT(img_list, gt[0], gt=gt, display=0)
+            _, precision, _, iou = _compile_results(gt, result_bb, 20)
+            print '%-6s %-10s %11.1f %10.2f %9d %9.2f %6.2f %6.2f %7.2f' % \
+                  ('%d%%' % (round(ratio * 100)), seq, t_critic, t_actor, n_params,
+                   precision, _success_auc(gt, result_bb), iou, fps)
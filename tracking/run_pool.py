@@ -0,0 +1,150 @@
+import Queue
+import shutil
+import signal
+import tempfile
+import argparse
+import multiprocessing
+
+from run_tracker import *
+from run_tracker import _init_video, _compile_results
+
+
+def share_weights(path, target, shm_dir):
+    #
+    # flat copy of the weights at path in shm_dir, which every worker maps
+    # copy-on-write: pages of layers that are never written stay shared by
+    # all workers, those of the layers a worker trains become its private
+    # copies; workers run with actor_fc_only, so that besides the critic's
+    # conv1-conv3 the actor's conv layers are never written either, and only
+    # the critic's fc4-fc5 and the actor's fc1-fc2 become private
+    # .flat files are already mapped from the page cache and used as they are
+    if os.path.splitext(path)[1] == '.flat':
+        return path
+    dst = os.path.join(shm_dir, os.path.splitext(os.path.basename(path))[0] + '.flat')
+    convert_weights(path, dst, target)
+    return dst
+
+
+def proc_memory(paths=None, pid='self'):
+    #
+    # [rss, pss, private] in MB of process pid, and [shared, private] MB of
+    # its mappings of the files in paths: pages that other workers map too,
+    # and those only this one has (its copies of written pages)
+    if paths is None:
+        paths = []
+    totals = np.zeros(3)
+    mapped = np.zeros(2)
+    in_paths = False
+    with open('/proc/%s/smaps' % (pid)) as f:
+        for line in f:
+            fields = line.split()
+            if not fields[0].endswith(':'):
+                # header line of the next mapping, the file name is last
+                in_paths = len(fields) > 5 and fields[-1] in paths
+                continue
+            name = fields[0][:-1]
+            if name not in ['Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty']:
+                continue
+            size = int(fields[1]) / 1024.
+            if name in ['Rss', 'Pss']:
+                totals[['Rss', 'Pss'].index(name)] += size
+            elif name.startswith('Private'):
+                totals[2] += size
+            if in_paths and name != 'Rss' and name != 'Pss':
+                mapped[int(name.startswith('Private'))] += size
+    return list(totals) + list(mapped)
+
+
+def track(i, seq, n_frames, overrides, queue):
+    opts.update(overrides)
+    gt, img_list, _, _ = _init_video('../dataset', seq)
+    if n_frames > 0:
+        gt = gt[:n_frames]
+        img_list = img_list[:n_frames]
+    try:
+        bboxes, result_bb, fps = run_ACT(img_list, gt[0], gt=gt, display=0)
+        _, precision, _, iou = _compile_results(gt, result_bb, 20)
+        queue.put((i, [precision, iou, fps]))
+    except Exception as e:
+        queue.put((i, e))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--seq', action='append', default=[],
+                        help='input seq, one tracker process each')
+    parser.add_argument('-n', '--frames', type=int, default=0, help='first n frames only')
+    parser.add_argument('-p', '--pin', action='store_true',
+                        help='run worker i on the CPU, pinned to core i (mod the number of cores), one thread each')
+    parser.add_argument('--private', action='store_true', help='every worker loads its own weights')
+    args = parser.parse_args()
+    seqs = args.seq or ['Car4']
+
+    opts['show_train'] = 0
+    # remove the shared weights also when the supervisor is terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    shm_dir = tempfile.mkdtemp(prefix='act-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    workers = []
+    try:
+        # also with private weights, so that both modes track the same way
+        overrides = {'actor_fc_only': True}
+        shared = []
+        if not args.private:
+            overrides['model_path'] = share_weights(opts['model_path'], 'critic', shm_dir)
+            overrides['actor_path'] = share_weights(opts['actor_path'], 'actor', shm_dir)
+            # held and read once here, so that workers find every page resident
+            for path in [overrides['model_path'], overrides['actor_path']]:
+                shared.append(load_flat(path))
+                sum([t.sum() for t in shared[-1].values()])
+
+        queue = multiprocessing.Queue()
+        for i, seq in enumerate(seqs):
+            worker_opts = dict(overrides)
+            if args.pin:
+                # the CPU profile only applies to workers that run on the CPU
+                worker_opts.update({'use_gpu': False, 'cpu_profile': True, 'cpu_threads': 1,
+                                    'cpu_interop_threads': 1, 'cpu_affinity': [i % multiprocessing.cpu_count()]})
+            worker = multiprocessing.Process(target=track, args=(i, seq, args.frames, worker_opts, queue))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        # peak of each memory figure of each worker while tracking
+        paths = [overrides.get('model_path', opts['model_path']), overrides.get('actor_path', opts['actor_path'])]
+        results = {}
+        memory = {}
+        while len(results) < len(workers):
+            try:
+                i, result = queue.get(timeout=0.5)
+                results[i] = result
+            except Queue.Empty:
+                if not any([worker.is_alive() for worker in workers]):
+                    break
+            for i, worker in enumerate(workers):
+                if i not in results and worker.is_alive():
+                    try:
+                        sample = proc_memory(paths, worker.pid)
+                    except IOError:
+                        continue
+                    memory[i] = list(np.maximum(memory.get(i, sample), sample))
+        for worker in workers:
+            worker.join()
+    finally:
+        # workers still running when the supervisor fails or is terminated
+        # are stopped before their weights are removed
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        shutil.rmtree(shm_dir)
+
+    print '%-10s %9s %6s %7s %8s %8s %8s %13s %12s' % \
+          ('seq', 'precision', 'IOU', 'fps', 'RSS MB', 'PSS MB', 'priv MB', 'weights shared', 'weights priv')
+    for i, seq in enumerate(seqs):
+        result = results.get(i, RuntimeError("worker exited"))
+        if isinstance(result, Exception):
+            print '%-10s failed: %s' % (seq, result)
+            continue
+        print '%-10s %9.2f %6.2f %7.2f %8.1f %8.1f %8.1f %13.1f %12.1f' % \
+              tuple([seq] + result + memory.get(i, [np.nan] * 5))
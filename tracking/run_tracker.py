@@ -1,8 +1,8 @@
 import sys
 import time
+import threading
 import argparse
 import matplotlib.pyplot as plt
-from scipy.misc import imresize
 import torch.optim as optim
 from torch.autograd import Variable
 import os
@@ -17,6 +17,8 @@ from options import *
 from gen_config import *
 from actor import *
 from region_to_bbox import *
+from cpu_profile import *
+from scripted import *
 import cv2
 
 np.random.seed(123)
@@ -77,6 +79,13 @@ def _compile_results(gt, bboxes, dist_threshold):
     return l, precision, precision_auc, iou
 
 
+def _success_auc(gt, bboxes):
+    # area under the OTB success plot: mean success rate over IoU thresholds 0-1
+    ious = np.array([_compute_iou(bboxes[i, :], region_to_bbox(gt[i, :], center=False))
+                     for i in range(np.size(bboxes, 0))])
+    return np.mean([np.mean(ious > t) for t in np.linspace(0, 1, 21)]) * 100
+
+
 def _compute_distance(boxA, boxB):
     a = np.array((boxA[0] + boxA[2] / 2, boxA[1] + boxA[3] / 2))
     b = np.array((boxB[0] + boxB[2] / 2, boxB[1] + boxB[3] / 2))
@@ -131,89 +140,95 @@ def crop_image_blur(img, bbox):
 
     return cropped
 
-def getbatch_actor(img, boxes):
+def to_input(x):
+    # batch x as network input, on the device the networks run on
+    if opts['use_gpu']:
+        x = x.cuda()
+    return Variable(x)
+
+def configure_cpu(model, actor):
+    #
+    # CPU execution profile of opts for this tracker process and its models
+    set_cpu_threads(opts['cpu_threads'], opts['cpu_interop_threads'])
+    if opts['cpu_affinity'] is not None:
+        set_cpu_affinity(opts['cpu_affinity'])
+    if opts['inplace_relu']:
+        inplace_relu(model)
+        inplace_relu(actor)
+
+def getbatch_actor(frame, boxes, model=None):
     crop_size = 107
 
     num_boxes = boxes.shape[0]
-    imo_g = np.zeros([num_boxes, crop_size, crop_size, 3])
-    imo_l = np.zeros([num_boxes, crop_size, crop_size, 3])
+    imo_g = np.empty([num_boxes, crop_size, crop_size, 3], dtype='float32')
 
-    for i in range(num_boxes):
-        bbox = boxes[i]
-        img_crop_l, img_crop_g, out_flag = crop_image_actor(img, bbox)
+    # global crop of the 2x window around the box
+    frame.crop(boxes, crop_size, crop_size / 2., out=imo_g)
+    out_flag = crop_out_flag(frame.array, boxes[-1])
 
-        imo_g[i] = img_crop_g
-        imo_l[i] = img_crop_l
-
-    imo_g = imo_g.transpose(0, 3, 1, 2).astype('float32')
+    imo_g = imo_g.transpose(0, 3, 1, 2)
     imo_g = imo_g - 128.
-    imo_g = torch.from_numpy(imo_g)
-    imo_g = Variable(imo_g)
-    imo_g = imo_g.cuda()
-    imo_l = imo_l.transpose(0, 3, 1, 2).astype('float32')
+    imo_g = to_input(torch.from_numpy(imo_g))
+
+    # with a shared backbone, the local input is the critic's conv3 of the box
+    if model is not None:
+        imo_l = forward_samples(model, frame, boxes)
+        imo_l = to_input(imo_l.view(num_boxes, -1, 3, 3))
+        return imo_g, imo_l, out_flag
+
+    # local crop of the box itself
+    imo_l = np.empty([num_boxes, crop_size, crop_size, 3], dtype='float32')
+    frame.crop(boxes, crop_size, 0, out=imo_l)
+    imo_l = imo_l.transpose(0, 3, 1, 2)
     imo_l = imo_l - 128.
-    imo_l = torch.from_numpy(imo_l)
-    imo_l = Variable(imo_l)
-    imo_l = imo_l.cuda()
+    imo_l = to_input(torch.from_numpy(imo_l))
 
     return imo_g, imo_l, out_flag
 
-def crop_image_actor(img, bbox, img_size=107, padding=0, valid=False):
+class ActorSpeculation(threading.Thread):
+    #
+    # takes the next frame from frames and runs the actor on it from a proposed
+    # box in the background, so that it overlaps with the critic verification
+    # of the current frame; frame or deta_pos stays None if the thread failed
+    def __init__(self, actor, frames, bbox):
+        super(ActorSpeculation, self).__init__()
+        self.daemon = True
+        self.actor = actor
+        self.frames = frames
+        self.bbox = np.array(bbox)
+        self.frame = None
+        self.out_flag = None
+        self.deta_pos = None
+        # the number of intra-op threads is per thread in OpenMP builds
+        self.threads = torch.get_num_threads()
+        self.start()
+
+    def run(self):
+        torch.set_num_threads(self.threads)
+        self.frame = self.frames.get()
+        img_g, img_l, out_flag = getbatch_actor(self.frame, self.bbox.reshape([1, 4]))
+        deta_pos = self.actor(img_l, img_g)
+        self.out_flag = out_flag
+        self.deta_pos = deta_pos.data.clone().cpu().numpy()
+
+def crop_out_flag(img, bbox):
+    # 1 if the 2x window sticks out of the image by more than 30% of the box
     x, y, w, h = np.array(bbox, dtype='float32')
 
     half_w, half_h = w / 2, h / 2
     center_x, center_y = x + half_w, y + half_h
-    out_flag = 0
-    if padding > 0:
-        pad_w = padding * w / img_size
-        pad_h = padding * h / img_size
-        half_w += pad_w
-        half_h += pad_h
 
     img_h, img_w, _ = img.shape
-    min_x = int(center_x - half_w + 0.5)
-    min_y = int(center_y - half_h + 0.5)
-    max_x = int(center_x + half_w + 0.5)
-    max_y = int(center_y + half_h + 0.5)
-
-    if min_x >= 0 and min_y >= 0 and max_x <= img_w and max_y <= img_h:
-        cropped = img[min_y:max_y, min_x:max_x, :]
-
-    else:
-        min_x_val = max(0, min_x)
-        min_y_val = max(0, min_y)
-        max_x_val = min(img_w, max_x)
-        max_y_val = min(img_h, max_y)
-
-        cropped = 128 * np.ones((max_y - min_y, max_x - min_x, 3), dtype='uint8')
-        cropped[min_y_val - min_y:max_y_val - min_y, min_x_val - min_x:max_x_val - min_x, :] \
-            = img[min_y_val:max_y_val, min_x_val:max_x_val, :]
-
-    scaled_l = imresize(cropped, (img_size, img_size))
-
     min_x = int(center_x - w + 0.5)
     min_y = int(center_y - h + 0.5)
     max_x = int(center_x + w + 0.5)
     max_y = int(center_y + h + 0.5)
 
-
-    if min_x >= 0 and min_y >= 0 and max_x <= img_w and max_y <= img_h:
-        cropped = img[min_y:max_y, min_x:max_x, :]
-
-    else:
-        min_x_val = max(0, min_x)
-        min_y_val = max(0, min_y)
-        max_x_val = min(img_w, max_x)
-        max_y_val = min(img_h, max_y)
-        if max(abs(min_y - min_y_val) / half_h, abs(max_y - max_y_val) / half_h, abs(min_x - min_x_val) / half_w, abs(max_x - max_x_val) / half_w) > 0.3:
-            out_flag = 1
-        cropped = 128 * np.ones((max_y - min_y, max_x - min_x, 3), dtype='uint8')
-        cropped[min_y_val - min_y:max_y_val - min_y, min_x_val - min_x:max_x_val - min_x, :] \
-            = img[min_y_val:max_y_val, min_x_val:max_x_val, :]
-
-    scaled_g = imresize(cropped, (img_size, img_size))
-
-    return scaled_l, scaled_g, out_flag
+    out_x = max(-min_x, max_x - img_w, 0) / half_w
+    out_y = max(-min_y, max_y - img_h, 0) / half_h
+    if max(out_x, out_y) > 0.3:
+        return 1
+    return 0
 
 def move_crop(pos_, deta_pos, img_size, rate):
     flag = 0
@@ -258,22 +273,44 @@ def cal_distance(samples, ground_th):
     distance = np.hstack([distance, rate])
     return distance
 
-def init_actor(actor, image, gt):
+def init_actor(actor, frame, gt, model=None):
+    #
+    # with model given, the actor's local branch runs on the critic's frozen
+    # conv1-conv3 and only the layers above it are adapted; with actor_fc_only
+    # only fc1-fc2 are
     np.random.seed(123)
     torch.manual_seed(456)
     torch.cuda.manual_seed(789)
 
     batch_num = 64
     maxiter = 80
-    actor = actor.cuda()
+    if opts['use_gpu']:
+        actor = actor.cuda()
     actor.train()
-    init_optimizer = torch.optim.Adam(actor.parameters(), lr=0.0001)
+    in_layer = 'conv1'
+    params = list(actor.parameters())
+    if model is not None:
+        in_layer = 'conv4'
+        params = [p for n, p in actor.named_parameters() if n.split('.')[0] not in ['conv1_l', 'conv2_l', 'conv3_l']]
+    if opts['actor_fc_only']:
+        params = []
+        for n, p in actor.named_parameters():
+            p.requires_grad = n.startswith('fc')
+            if p.requires_grad:
+                params.append(p)
+    untie_flat(actor, params)
+    init_optimizer = torch.optim.Adam(params, lr=0.0001)
     loss_func = torch.nn.MSELoss()
-    _, _, out_flag_first = getbatch_actor(np.array(image), np.array(gt).reshape([1, 4]))
-    actor_samples = np.round(gen_samples(SampleGenerator('uniform', image.size, 0.3, 1.5, None),
+    actor_samples = np.round(gen_samples(SampleGenerator('uniform', frame.size, 0.3, 1.5, None),
                                          gt, 1500, [0.6, 1], [0.9, 1.1]))
+    if model is not None:
+        # local features pooled from a shared conv3 map, as the tracking loop
+        # feeds them, of a region around gt that holds all the samples
+        share_search_region(model, frame, gt, actor_samples)
+    _, _, out_flag_first = getbatch_actor(frame, np.array(gt).reshape([1, 4]), model)
     idx = np.random.permutation(actor_samples.shape[0])
-    batch_img_g, batch_img_l, _ = getbatch_actor(np.array(image), actor_samples)
+    batch_img_g, batch_img_l, _ = getbatch_actor(frame, actor_samples, model)
+    frame.search = None
     batch_distance = cal_distance(actor_samples, np.tile(gt, [actor_samples.shape[0], 1]))
     batch_distance = np.array(batch_distance).astype(np.float32)
 
@@ -287,41 +324,315 @@ def init_actor(actor, image, gt):
         next = pointer + batch_num
         cur_idx = idx[pointer: next]
         pointer = next
-        feat = actor(batch_img_l[cur_idx], batch_img_g[cur_idx])
+        feat = actor(batch_img_l[cur_idx], batch_img_g[cur_idx], in_layer)
 
-        loss = loss_func(feat, Variable(
-            torch.FloatTensor(batch_distance[cur_idx]).cuda()))  # must be (1. nn output, 2. target)
+        loss = loss_func(feat, to_input(
+            torch.FloatTensor(batch_distance[cur_idx])))  # must be (1. nn output, 2. target)
 
         actor.zero_grad()  # clear gradients for next train
         loss.backward()  # backpropagation, compute gradients
         init_optimizer.step()  # apply gradients
+        # a 1-element tensor before torch 0.4, 0-dim after
+        loss_value = float(loss.data.cpu().numpy())
         if opts['show_train']:
-            print "Iter %d, Loss %.10f" % (iter, loss.data[0])
-        if loss.data[0] < 0.0001:
+            print "Iter %d, Loss %.10f" % (iter, loss_value)
+        if loss_value < 0.0001:
             deta_flag = 0
             # print iter
+            actor.pack()
             return deta_flag, out_flag_first
     deta_flag = 1
+    actor.pack()
     return deta_flag, out_flag_first
 
 def forward_samples(model, image, samples, out_layer='conv3'):
     np.random.seed(123)
     torch.manual_seed(456)
     torch.cuda.manual_seed(789)
+    return extract_samples(model, image, samples, out_layer)
 
+def extract_samples(model, image, samples, out_layer='conv3'):
+    # forward_samples without reseeding the random state, for the online
+    # update thread
     model.eval()
-    extractor = RegionExtractor(image, samples, opts['img_size'], opts['padding'], opts['batch_test'])
+    if not isinstance(image, FrameCache):
+        image = FrameCache(image)
+    if isinstance(out_layer, (list, tuple)):
+        out_layers = list(out_layer)
+    else:
+        out_layers = [out_layer]
+
+    if len(samples) == 0:
+        empty = torch.cuda.FloatTensor() if opts['use_gpu'] else torch.FloatTensor()
+        feats = [empty.clone() for l in out_layers]
+        if isinstance(out_layer, (list, tuple)):
+            return feats
+        return feats[0]
+
+    # samples with the same crop window get the same features, so only the
+    # first occurrence of each window that this frame has not seen yet on
+    # the same extraction path is run
+    path = region_path(image, samples)
+    windows = crop_windows(samples, opts['img_size'], opts['padding'])
+    keys = [tuple(window) for window in windows]
+    todo = []
+    seen = set()
+    for i, key in enumerate(keys):
+        if key in seen:
+            continue
+        seen.add(key)
+        if any([(path, l, key) not in image.memo for l in out_layers]):
+            todo.append(i)
+
+    image.n_candidates += len(keys)
+    image.n_scored += len(todo)
+
+    fresh = {}
+    if len(todo):
+        outputs, used = forward_regions(model, image, samples[todo], out_layers, path)
+        for l, output in zip(out_layers, outputs):
+            for j, i in enumerate(todo):
+                fresh[(l, keys[i])] = output[j]
+                image.memo[(used[j], l, keys[i])] = output[j]
+
+    if len(todo) == len(keys):
+        feats = outputs
+    else:
+        feats = [torch.stack([fresh[(l, key)] if (l, key) in fresh else image.memo[(path, l, key)]
+                              for key in keys], 0) for l in out_layers]
+
+    if isinstance(out_layer, (list, tuple)):
+        return feats
+    return feats[0]
+
+def region_path(frame, samples):
+    #
+    # how forward_regions extracts the features of samples: 'search' pooled
+    # from the conv3 map the frame shares, 'roi' pooled from conv3 maps of
+    # their own search regions, 'crop' from one crop each
+    if frame.search is not None:
+        search = frame.search[0]
+        crops = search.map_windows(samples)
+        if search.contains(crops) and search.fits(crops, opts['roi_scale_ratio']):
+            return 'search'
+    if opts['roi_align'] and len(samples) > 1:
+        return 'roi'
+    return 'crop'
+
+def forward_regions(model, frame, samples, out_layers, path=None):
+    # out_layers features of samples and the path each of them came from,
+    # 'roi' falls back to 'crop' for the samples whose search region would
+    # be too large
+    if path is None:
+        path = region_path(frame, samples)
+
+    if path == 'search':
+        search, feat_map = frame.search
+        return pool_regions(model, feat_map, search.map_windows(samples), out_layers), [path] * len(samples)
+
+    if path != 'roi':
+        return forward_crops(model, frame, samples, out_layers), ['crop'] * len(samples)
+
+    parts = forward_regions_roi(model, frame, samples, out_layers)
+    paths = ['crop'] * len(samples)
+    for idx, _ in parts:
+        for i in idx:
+            paths[i] = 'roi'
+    rest = np.array([i for i, used in enumerate(paths) if used == 'crop'], dtype='int')
+    if len(rest):
+        parts.append((rest, forward_crops(model, frame, samples[rest], out_layers)))
+    return merge_parts(parts), paths
+
+def forward_crops(model, frame, samples, out_layers):
+    extractor = RegionExtractor(frame, samples, opts['img_size'], opts['padding'], opts['batch_test'])
+    feats = [[] for _ in out_layers]
     for i, regions in enumerate(extractor):
-        regions = Variable(regions)
-        if opts['use_gpu']:
-            regions = regions.cuda()
-        feat = model(regions, out_layer=out_layer)
-        if i == 0:
-            feats = feat.data.clone()
-        else:
-            feats = torch.cat((feats, feat.data.clone()), 0)
+        regions = to_input(regions)
+        outputs = model(regions, out_layer=out_layers)
+        for feat, output in zip(feats, outputs):
+            feat.append(output.data)
+    return [torch.cat(feat, 0) for feat in feats]
+
+def forward_regions_roi(model, frame, samples, out_layers, zoom=1.):
+    #
+    # out_layers features of samples pooled from one conv3 map of the search
+    # region of each scale_groups group, as (sample indices, features) parts;
+    # groups whose region would be too large are left out
+    parts = []
+    for idx in scale_groups(samples):
+        search = SearchRegion(frame, samples[idx], opts['img_size'], opts['padding'], opts['roi_max_size'], zoom)
+        if search.region is None:
+            continue
+
+        region = to_input(search.region)
+        feat_map = model.forward_map(region)
+        parts.append((idx, pool_regions(model, feat_map, search.crops, out_layers)))
+    return parts
+
+def scale_groups(samples):
+    #
+    # indices of samples split into groups, in order of size, whose widths and
+    # heights each lie within roi_scale_ratio of each other, so that a search
+    # region scaled for the mean size resamples every box of its group to
+    # within that ratio of img_size
+    ratio = opts['roi_scale_ratio']
+    order = np.argsort(samples[:,2] * samples[:,3])
+    if not len(order):
+        return []
+    groups = []
+    start = 0
+    min_w, min_h = samples[order[0], 2:]
+    max_w, max_h = min_w, min_h
+    for j in range(1, len(order)):
+        w, h = samples[order[j], 2:]
+        min_w, max_w = min(min_w, w), max(max_w, w)
+        min_h, max_h = min(min_h, h), max(max_h, h)
+        if max_w > min_w * ratio or max_h > min_h * ratio:
+            groups.append(order[start:j])
+            start = j
+            min_w, min_h = w, h
+            max_w, max_h = w, h
+    groups.append(order[start:])
+    return groups
+
+def merge_parts(parts):
+    # features of all samples in order from (sample indices, features) parts
+    # that together hold each sample once
+    idx = np.concatenate([p[0] for p in parts])
+    index = torch.from_numpy(np.argsort(idx))
+    feats = []
+    for k in range(len(parts[0][1])):
+        feat = torch.cat([p[1][k] for p in parts], 0)
+        if feat.is_cuda:
+            index = index.cuda()
+        feats.append(feat.index_select(0, index))
     return feats
 
+def pool_regions(model, feat_map, crops, out_layers):
+    head_layers = [l for l in out_layers if l != 'conv3']
+
+    feats = [[] for _ in out_layers]
+    for start in range(0, len(crops), opts['batch_test']):
+        end = min(start + opts['batch_test'], len(crops))
+        feat = model.roi_align(feat_map, crops[start:end])
+        outputs = {'conv3': feat.view(feat.size(0), -1)}
+        if len(head_layers):
+            outputs.update(zip(head_layers, model(outputs['conv3'], in_layer='fc4', out_layer=head_layers)))
+        for feat, l in zip(feats, out_layers):
+            feat.append(outputs[l].data)
+    return [torch.cat(feat, 0) for feat in feats]
+
+def share_search_region(model, frame, bbox, samples=None):
+    #
+    # conv3 map of the region around bbox that also holds the box moved by
+    # up to shared_margin of its size, so that the actor's local features
+    # and the verification of the box it proposes come from one backbone pass;
+    # the region also holds samples when given
+    np.random.seed(123)
+    torch.manual_seed(456)
+    torch.cuda.manual_seed(789)
+
+    model.eval()
+    bbox = np.array(bbox, dtype='float32')
+    shifts = np.array([[-1, -1], [-1, 1], [1, -1], [1, 1]], dtype='float32') * opts['shared_margin']
+    extremes = np.hstack([bbox[:2] + shifts * bbox[2:], np.tile(bbox[2:], (4, 1))])
+    if samples is not None:
+        extremes = np.vstack([extremes, samples])
+    search = SearchRegion(frame, extremes, opts['img_size'], opts['padding'], opts['roi_max_size'])
+    frame.search = None
+    if search.region is None:
+        return
+
+    region = to_input(search.region)
+    frame.search = (search, model.forward_map(region))
+
+def prefilter_samples(model, frame, samples):
+    #
+    # cheap first cascade stage: fc6 scores pooled from conv3 maps of the
+    # search regions at cascade_zoom resolution, only the best cascade_keep
+    # fraction of the samples (at least the 5 that get averaged) is kept,
+    # along with the samples whose region would be too large
+    n_keep = max(int(np.ceil(len(samples) * opts['cascade_keep'])), 5)
+    if n_keep >= len(samples):
+        return samples
+
+    np.random.seed(123)
+    torch.manual_seed(456)
+    torch.cuda.manual_seed(789)
+
+    model.eval()
+    parts = forward_regions_roi(model, frame, samples, ['fc6'], opts['cascade_zoom'])
+    if not len(parts):
+        return samples
+    idx = np.concatenate([p[0] for p in parts])
+    scores = torch.cat([p[1][0] for p in parts], 0)
+    _, top = scores[:, 1].topk(min(n_keep, len(idx)))
+    keep = np.union1d(idx[top.cpu().numpy()], np.setdiff1d(np.arange(len(samples)), idx))
+    return samples[keep]
+
+def forward_dense(model, frame, bbox, sizes, trans_f):
+    #
+    # scores every stride-16 position of a search window around bbox, once per
+    # target size, by running fc4-fc6 densely over one conv3 map
+    # returns the boxes, their fc6 scores and conv3 features like forward_samples
+    np.random.seed(123)
+    torch.manual_seed(456)
+    torch.cuda.manual_seed(789)
+
+    model.eval()
+    crop_size = opts['img_size']
+    padding = opts['padding']
+    stride = model.roi_align.stride
+
+    bbox = np.array(bbox, dtype='float32')
+    center = bbox[:2] + bbox[2:] / 2
+    radius = trans_f * np.mean(bbox[2:])
+    corners = np.array([[-1, -1], [-1, 1], [1, -1], [1, 1]], dtype='float32')
+
+    samples = []
+    scores = []
+    feats = []
+    for size in sizes:
+        # the search window is the union of the extreme candidate positions
+        size = np.array(size, dtype='float32')
+        extremes = np.hstack([center + radius * corners - size / 2, np.tile(size, (4, 1))])
+        search = SearchRegion(frame, extremes, crop_size, padding, opts['roi_max_size'])
+        if search.region is None:
+            continue
+
+        region = to_input(search.region)
+        feat_map = model.forward_map(region)
+        score_map = model.forward_dense(feat_map)
+
+        # box behind each score, from the crop window at that position
+        h, w = score_map.size(2), score_map.size(3)
+        ys, xs = np.mgrid[0:h, 0:w]
+        ys = ys.reshape(-1)
+        xs = xs.reshape(-1)
+        box_wh = crop_size / search.scale / (1 + 2. * padding / crop_size)
+        boxes = np.zeros((h * w, 4), dtype='float32')
+        boxes[:,0] = search.origin[0] + stride * xs / search.scale[0] + padding * box_wh[0] / crop_size
+        boxes[:,1] = search.origin[1] + stride * ys / search.scale[1] + padding * box_wh[1] / crop_size
+        boxes[:,2:] = box_wh
+        samples.append(boxes)
+        scores.append(score_map.data.view(score_map.size(1), -1).t().contiguous())
+
+        # 3x3 conv3 window behind each score, flattened like MDNet's conv3
+        C, H, W = feat_map.size(1), feat_map.size(2), feat_map.size(3)
+        idx = (ys[:,None,None] + np.arange(3)[None,:,None]) * W + xs[:,None,None] + np.arange(3)[None,None,:]
+        idx = torch.from_numpy(idx.reshape(-1))
+        if opts['use_gpu']:
+            idx = idx.cuda()
+        feat = feat_map.data.view(C, H * W).index_select(1, idx)
+        feats.append(feat.view(C, h * w, 9).permute(1, 0, 2).contiguous().view(h * w, -1))
+
+    if len(samples) == 0:
+        return None
+    samples = np.concatenate(samples)
+    frame.n_candidates += len(samples)
+    frame.n_scored += len(samples)
+    return samples, torch.cat(scores, 0), torch.cat(feats, 0)
+
 def set_optimizer(model, lr_base, lr_mult=opts['lr_mult'], momentum=opts['momentum'], w_decay=opts['w_decay']):
     params = model.get_learnable_params()
     param_list = []
@@ -334,11 +645,31 @@ def set_optimizer(model, lr_base, lr_mult=opts['lr_mult'], momentum=opts['moment
     optimizer = optim.SGD(param_list, lr=lr, momentum=momentum, weight_decay=w_decay)
     return optimizer
 
-def train(model, criterion, optimizer, pos_feats, neg_feats, maxiter, in_layer='fc4'):
+def train_order(n_pos, n_neg, maxiter):
+    #
+    # pos and neg feature indices of maxiter training batches, drawn after
+    # reseeding as every training run does
     np.random.seed(123)
     torch.manual_seed(456)
     torch.cuda.manual_seed(789)
 
+    batch_pos = opts['batch_pos']
+    batch_neg_cand = max(opts['batch_neg_cand'], opts['batch_neg'])
+
+    pos_idx = np.random.permutation(n_pos)
+    neg_idx = np.random.permutation(n_neg)
+    while (len(pos_idx) < batch_pos * maxiter):
+        pos_idx = np.concatenate([pos_idx, np.random.permutation(n_pos)])
+    while (len(neg_idx) < batch_neg_cand * maxiter):
+        neg_idx = np.concatenate([neg_idx, np.random.permutation(n_neg)])
+    return pos_idx, neg_idx
+
+def train(model, criterion, optimizer, pos_feats, neg_feats, maxiter, in_layer='fc4', order=None):
+    # order: batch indices from train_order, drawn here if not given
+    if order is None:
+        order = train_order(pos_feats.size(0), neg_feats.size(0), maxiter)
+    pos_idx, neg_idx = order
+
     model.train()
 
     batch_pos = opts['batch_pos']
@@ -346,12 +677,6 @@ def train(model, criterion, optimizer, pos_feats, neg_feats, maxiter, in_layer='
     batch_test = opts['batch_test']
     batch_neg_cand = max(opts['batch_neg_cand'], batch_neg)
 
-    pos_idx = np.random.permutation(pos_feats.size(0))
-    neg_idx = np.random.permutation(neg_feats.size(0))
-    while (len(pos_idx) < batch_pos * maxiter):
-        pos_idx = np.concatenate([pos_idx, np.random.permutation(pos_feats.size(0))])
-    while (len(neg_idx) < batch_neg_cand * maxiter):
-        neg_idx = np.concatenate([neg_idx, np.random.permutation(neg_feats.size(0))])
     pos_pointer = 0
     neg_pointer = 0
 
@@ -389,17 +714,168 @@ def train(model, criterion, optimizer, pos_feats, neg_feats, maxiter, in_layer='
             model.train()
 
         # forward
-        pos_score = model(batch_pos_feats, in_layer=in_layer)
-        neg_score = model(batch_neg_feats, in_layer=in_layer)
+        loss = model.train_loss(batch_pos_feats, batch_neg_feats, criterion, in_layer)
 
         # optimize
-        loss = criterion(pos_score, neg_score)
         model.zero_grad()
         loss.backward()
         torch.nn.utils.clip_grad_norm(model.parameters(), opts['grad_clip'])
         optimizer.step()
         if opts['show_train']:
-            print "Iter %d, Loss %.10f" % (iter, loss.data[0])
+            print "Iter %d, Loss %.10f" % (iter, float(loss.data.cpu().numpy()))
+
+    # int8 fc4-fc6 follow the updated float weights
+    model.requantize()
+
+class OnlineUpdate(object):
+    #
+    # double-buffered online updates of fc4-fc6 (update_async): a worker
+    # thread extracts the conv3 features of the frames to learn from and
+    # trains a copy of the critic (the back buffer) on them, while the
+    # tracker keeps scoring with model; poll(), called between frames, copies
+    # the trained fc weights into model when the worker is done, so that no
+    # frame is scored with a half updated head
+    # the weights are copied rather than swapped, so that the int8 and
+    # TorchScript copies of model, which alias its parameters, follow them
+    # the features come from model through extract_samples, as forward_samples
+    # gives them to synchronous updates (int8, RoIAlign and shared maps
+    # included): model's conv1-conv3 are not trained online, and its eval
+    # mode passes run alongside the tracker's
+    # the back buffer draws its dropout masks from a RandomState of its own,
+    # reseeded for every update: the tracking thread reseeds torch's global
+    # generator while the worker trains, and the worker never touches it
+    def __init__(self, model, criterion):
+        self.model = model
+        self.criterion = criterion
+        self.back = MDNet(widths=model.widths)
+        self.back.load_state_dict(model.state_dict())
+        self.rng = np.random.RandomState()
+        for seq in self.back.modules():
+            for name, m in seq.named_children():
+                if isinstance(m, nn.Dropout):
+                    seq._modules[name] = SeededDropout(m.p, self.rng)
+        if opts['use_gpu']:
+            self.back = self.back.cuda()
+        self.back.set_learnable_params(opts['ft_layers'])
+        self.optimizer = set_optimizer(self.back, opts['lr_update'])
+        self.worker = None
+        self.pending = None
+        self.error = None
+        self.extracted = []
+        self.n_started = 0
+        self.n_replaced = 0
+
+    def submit(self, job, maxiter):
+        #
+        # job: one (frame id, feats, samples) per frame to learn from, feats
+        # its (pos, neg) conv3 features, or None and samples (frame, pos
+        # examples, neg examples) to extract them from
+        # the job is started by the next poll(), so that it does not compete
+        # with the redetection of the frame that asked for it; it waits for
+        # a running update, and a newer job replaces it
+        if self.pending is not None:
+            self.n_replaced += 1
+        self.pending = (job, maxiter)
+
+    def poll(self):
+        #
+        # swaps in the weights of a finished update and starts the pending one;
+        # returns the (frame id, pos feats, neg feats) the finished update
+        # extracted, for the tracker's feature cache
+        if self.worker is not None and self.worker.is_alive():
+            return []
+        extracted = []
+        if self.worker is not None:
+            self.worker = None
+            if self.error is not None:
+                raise self.error
+            self.swap()
+            extracted = self.extracted
+        if self.pending is not None:
+            self.start()
+        return extracted
+
+    def start(self):
+        job, maxiter = self.pending
+        self.pending = None
+        self.extracted = []
+        n_pos = sum([len(feats[0]) if feats is not None else len(samples[1]) for _, feats, samples in job])
+        n_neg = sum([len(feats[1]) if feats is not None else len(samples[2]) for _, feats, samples in job])
+        # drawn on the tracking thread, whose random state it resets
+        order = train_order(n_pos, n_neg, maxiter)
+        self.worker = threading.Thread(target=self.run, args=(torch.get_num_threads(), job, maxiter, order))
+        self.worker.daemon = True
+        self.worker.start()
+        self.n_started += 1
+
+    def run(self, threads, job, maxiter, order):
+        torch.set_num_threads(threads)
+        try:
+            self.rng.seed(456)
+            pos_feats = []
+            neg_feats = []
+            for frame_id, feats, samples in job:
+                if feats is None:
+                    image_, pos_examples, neg_examples = samples
+                    feats = [extract_samples(self.model, image_, examples) for examples in [pos_examples, neg_examples]]
+                    image_.release()
+                    self.extracted.append((frame_id, feats[0], feats[1]))
+                pos_feats.append(feats[0])
+                neg_feats.append(feats[1])
+            train(self.back, self.criterion, self.optimizer, torch.cat(pos_feats, 0), torch.cat(neg_feats, 0),
+                  maxiter, order=order)
+        except Exception as e:
+            self.error = e
+
+    def swap(self):
+        params = dict(self.model.named_parameters())
+        for name, p in self.back.named_parameters():
+            if p.requires_grad:
+                params[name].data.copy_(p.data)
+        # int8 fc4-fc6 follow the updated float weights
+        self.model.requantize()
+
+    def close(self):
+        # waits for a running update, which is then dropped like a pending one
+        if self.worker is not None:
+            self.worker.join()
+        self.worker = None
+        self.pending = None
+
+def script_models(model, actor, exported=None):
+    #
+    # TorchScript entry points of the critic and the actor, bound to their
+    # parameters when exported (from load_scripted), else traced from them
+    if exported is not None:
+        bind_scripted(exported, model, actor)
+        model.script(exported)
+        actor.script(exported['actor'])
+        return
+
+    crops = to_input(torch.zeros(1, 3, opts['img_size'], opts['img_size']))
+    model.script(trace_critic(model, crops))
+    if opts['shared_backbone']:
+        actor.script(trace_actor(actor, model(crops, out_layer='conv3').view(1, -1, 3, 3), crops, 'conv4'), 'conv4')
+    else:
+        actor.script(trace_actor(actor, crops, crops))
+
+def quantize_models(model, actor, frame, samples, actor_in='conv1'):
+    #
+    # int8 copies of the critic and the actor for CPU inference, with conv
+    # activation ranges calibrated on first frame crops of samples
+    np.random.seed(123)
+    torch.manual_seed(456)
+    torch.cuda.manual_seed(789)
+
+    samples = samples[np.random.permutation(len(samples))[:opts['quantize_calib']]]
+    regions = frame.crop(samples, opts['img_size'], opts['padding']).astype('float32')
+    regions = to_input(torch.from_numpy(regions.transpose(0, 3, 1, 2) - 128.))
+    model.eval()
+    model.quantize(opts['quantize'], regions)
+
+    shared = model if actor_in == 'conv4' else None
+    img_g, img_l, _ = getbatch_actor(frame, samples, shared)
+    actor.quantize(opts['quantize'], img_l, img_g, actor_in)
 
 def run_ACT(img_list, init_bbox, gt=None, savefig_dir='', display=False):
     # Init bbox
@@ -415,73 +891,104 @@ def run_ACT(img_list, init_bbox, gt=None, savefig_dir='', display=False):
     result_bb[0] = target_bbox
     success = 1
     # Init model
-    model = MDNet(opts['model_path'])
-    actor = Actor(opts['actor_path'])
+    if opts['quantize'] and opts['use_gpu']:
+        raise RuntimeError("INT8 inference runs on the CPU, set use_gpu to False")
+    if opts['lite_actor_path'] and (opts['shared_backbone'] or opts['jit_path']):
+        raise RuntimeError("lite_actor_path is not combined with shared_backbone or jit_path")
+    if opts['lite_model_path'] and opts['jit_path']:
+        raise RuntimeError("lite_model_path is not combined with jit_path")
+    exported = load_scripted(opts['jit_path']) if opts['jit_path'] else None
+    if exported is not None:
+        critic_widths, actor_widths = scripted_widths(exported)
+        model = MDNet(widths=critic_widths)
+        actor = Actor(None, opts['actor_fused'], actor_widths)
+    else:
+        model = MDNet(opts['lite_model_path'] or opts['model_path'])
+        if opts['lite_actor_path']:
+            actor = LiteActor(opts['lite_actor_path'])
+        else:
+            actor = Actor(opts['actor_path'], opts['actor_fused'])
+    if opts['shared_backbone'] and actor.widths[2] != 512:
+        raise RuntimeError("shared_backbone needs an actor with 512 conv3 channels")
 
     if opts['use_gpu']:
         model = model.cuda()
         actor = actor.cuda()
+    elif opts['cpu_profile']:
+        configure_cpu(model, actor)
     model.set_learnable_params(opts['ft_layers'])
+    if exported is not None or opts['jit']:
+        script_models(model, actor, exported)
 
     # Init criterion and optimizer
     criterion = BinaryLoss()
     init_optimizer = set_optimizer(model, opts['lr_init'])
     update_optimizer = set_optimizer(model, opts['lr_update'])
+    updater = None
 
-    image = Image.open(img_list[0]).convert('RGB')
+    frames = FrameSource(img_list, opts['prefetch'], opts['prefetch_workers'], opts['pyramid_levels'])
+    frame = frames.get()
+    image = frame.array
 
     # Train bbox regressor
-    bbreg_examples = gen_samples(SampleGenerator('uniform', image.size, 0.3, 1.5, 1.1),
+    bbreg_examples = gen_samples(SampleGenerator('uniform', frame.size, 0.3, 1.5, 1.1),
                                  target_bbox, opts['n_bbreg'], opts['overlap_bbreg'], opts['scale_bbreg'])
-    bbreg_feats = forward_samples(model, image, bbreg_examples)
-    bbreg = BBRegressor(image.size)
+    bbreg_feats = forward_samples(model, frame, bbreg_examples)
+    bbreg = BBRegressor(frame.size)
     bbreg.train(bbreg_feats, bbreg_examples, target_bbox)
 
     # Draw pos/neg samples
-    pos_examples = gen_samples(SampleGenerator('gaussian', image.size, 0.1, 1.2),
+    pos_examples = gen_samples(SampleGenerator('gaussian', frame.size, 0.1, 1.2),
                                target_bbox, opts['n_pos_init'], opts['overlap_pos_init'])
 
     neg_examples = np.concatenate([
-        gen_samples(SampleGenerator('uniform', image.size, 1, 2, 1.1),
+        gen_samples(SampleGenerator('uniform', frame.size, 1, 2, 1.1),
                     target_bbox, opts['n_neg_init'] // 2, opts['overlap_neg_init']),
-        gen_samples(SampleGenerator('whole', image.size, 0, 1.2, 1.1),
+        gen_samples(SampleGenerator('whole', frame.size, 0, 1.2, 1.1),
                     target_bbox, opts['n_neg_init'] // 2, opts['overlap_neg_init'])])
     neg_examples = np.random.permutation(neg_examples)
 
     # Extract pos/neg features
-    pos_feats = forward_samples(model, image, pos_examples)
-    neg_feats = forward_samples(model, image, neg_examples)
+    pos_feats = forward_samples(model, frame, pos_examples)
+    neg_feats = forward_samples(model, frame, neg_examples)
     feat_dim = pos_feats.size(-1)
 
     # Initial training
     train(model, criterion, init_optimizer, pos_feats, neg_feats, opts['maxiter_init'])
-    deta_flag, out_flag_first = init_actor(actor, image, target_bbox)
+    if opts['update_async']:
+        updater = OnlineUpdate(model, criterion)
+    shared = model if opts['shared_backbone'] else None
+    actor_in = 'conv4' if opts['shared_backbone'] else 'conv1'
+    deta_flag, out_flag_first = init_actor(actor, frame, target_bbox, shared)
+    actor.eval()
+    if opts['quantize']:
+        quantize_models(model, actor, frame, np.concatenate([pos_examples, neg_examples]), actor_in)
 
     # Init sample generators
-    init_generator = SampleGenerator('gaussian', image.size, opts['trans_f'], 1, valid=False)
-    sample_generator = SampleGenerator('gaussian', image.size, opts['trans_f'], opts['scale_f'], valid=False)
-    pos_generator = SampleGenerator('gaussian', image.size, 0.1, 1.2)
-    neg_generator = SampleGenerator('uniform', image.size, 1.5, 1.2)
+    init_generator = SampleGenerator('gaussian', frame.size, opts['trans_f'], 1, valid=False)
+    sample_generator = SampleGenerator('gaussian', frame.size, opts['trans_f'], opts['scale_f'], valid=False)
+    pos_generator = SampleGenerator('gaussian', frame.size, 0.1, 1.2)
+    neg_generator = SampleGenerator('uniform', frame.size, 1.5, 1.2)
+    motion = MotionModel(target_bbox, opts['motion_q'], opts['motion_r'])
 
     # Init pos/neg features for update
     pos_feats_all = [pos_feats[:opts['n_pos_update']]]
     neg_feats_all = [neg_feats[:opts['n_neg_update']]]
     data_frame = [0]
 
-    pos_score = forward_samples(model, image, np.array(init_bbox).reshape([1, 4]), out_layer='fc6')
-    img_learn = [image]
+    pos_score = forward_samples(model, frame, np.array(init_bbox).reshape([1, 4]), out_layer='fc6')
+    img_learn = [frame]
     pos_learn = [init_bbox]
     score_pos = [pos_score.cpu().numpy()[0][1]]
     frame_learn = [0]
     pf_frame = []
 
     update_lenth = 10
-    spf_total = 0
     # Display
     savefig = 0
     if display or savefig:
         dpi = 80.0
-        figsize = (image.size[0] / dpi, image.size[1] / dpi)
+        figsize = (frame.size[0] / dpi, frame.size[1] / dpi)
 
         fig = plt.figure(frameon=False, figsize=figsize, dpi=dpi)
         ax = plt.Axes(fig, [0., 0., 1., 1.])
@@ -504,22 +1011,122 @@ def run_ACT(img_list, init_bbox, gt=None, savefig_dir='', display=False):
         if savefig:
             fig.savefig(os.path.join(savefig_dir, '0000.jpg'), dpi=dpi)
     detetion = 0
-    imageVar_first = cv2.Laplacian(crop_image_blur(np.array(image), target_bbox), cv2.CV_64F).var()
+    imageVar_first = cv2.Laplacian(crop_image_blur(frame.array, target_bbox), cv2.CV_64F).var()
+    frame.release()
+    frame_stats = frame.pop_stats()
+    samples_log = np.zeros(len(img_list), dtype='int')
+    spf_log = np.zeros(len(img_list))
+    static_frame = frame
+    n_static = 0
+    target_score = score_pos[0]
+    imageVar = imageVar_first
+    spec = None
+    n_spec = 0
+
+    def finish_frame(i, frame, tic):
+        #
+        # per-frame bookkeeping that frames skipped by the static gate get
+        # too: motion model, timing, the frame's caches and stats, display;
+        # returns the frame's stats
+        if opts['motion_model'] and success:
+            motion.update(result[i])
+
+        spf = time.time() - tic
+        spf_log[i] = spf
+        frame.release()
+        stats = frame.pop_stats()
+
+        # Display
+        if display or savefig:
+            im.set_data(frame.array)
+
+            if gt is not None:
+                gt_rect.set_xy(gt[i, :2])
+                gt_rect.set_width(gt[i, 2])
+                gt_rect.set_height(gt[i, 3])
+
+            rect.set_xy(result_bb[i, :2])
+            rect.set_width(result_bb[i, 2])
+            rect.set_height(result_bb[i, 3])
+
+            if display:
+                plt.pause(.01)
+                plt.draw()
+            if savefig:
+                fig.savefig(os.path.join(savefig_dir, '%04d.jpg' % (i)), dpi=dpi)
+        if display:
+            if gt is None:
+                print "Frame %d/%d, Score %.3f, Time %.3f" % \
+                      (i, len(img_list), target_score, spf)
+            else:
+                if opts['show_train']:
+                    print "Frame %d/%d, Overlap %.3f, Score %.3f, Time %.3f, box (%d,%d,%d,%d), var %d, samples %d" % \
+                          (i, len(img_list), overlap_ratio(gt[i], result_bb[i])[0], target_score, spf, target_bbox[0],
+                           target_bbox[1], target_bbox[2], target_bbox[3], imageVar, samples_log[i])
+        return stats
 
     # Main loop
     for i in range(1, len(img_list)):
 
         tic = time.time()
-        # Load image
-        image = Image.open(img_list[i]).convert('RGB')
+        if updater is not None:
+            # features extracted by a finished update join the cache
+            for frame_id, pos_feats_, neg_feats_ in updater.poll():
+                if frame_id in data_frame:
+                    continue
+                pos_feats_all.append(pos_feats_)
+                neg_feats_all.append(neg_feats_)
+                data_frame.append(frame_id)
+                if len(pos_feats_all) > 10:
+                    del pos_feats_all[0]
+                    del neg_feats_all[0]
+                    del data_frame[0]
+        if opts['motion_model']:
+            motion.predict()
+        # Load image, or take it from the speculation started on the last frame
+        if spec is not None:
+            spec.join()
+            frame = spec.frame
+            if frame is None:
+                raise RuntimeError("Failed to load frame: %s" % (img_list[i]))
+        else:
+            frame = frames.get()
+        image = frame.array
+        # Skip the networks while the target region does not change
+        static = False
+        if opts['static_gate'] and n_static < opts['static_max_skip']:
+            window = np.array(target_bbox).reshape([1, 4])
+            patch = frame.crop(window, opts['static_size'], opts['static_size'] / 2.)
+            patch_ = static_frame.crop(window, opts['static_size'], opts['static_size'] / 2.)
+            static = np.abs(patch.astype('float32') - patch_).mean() < opts['static_thr']
+        if static:
+            n_static += 1
+        else:
+            static_frame = frame
+            n_static = 0
+
+        if static:
+            spec = None
+            result[i] = result[i - 1]
+            result_bb[i] = result_bb[i - 1]
+            frame_stats += finish_frame(i, frame, tic)
+            continue
+
         if imageVar_first > 200:
-            imageVar = cv2.Laplacian(crop_image_blur(np.array(image), target_bbox), cv2.CV_64F).var()
+            imageVar = cv2.Laplacian(crop_image_blur(frame.array, target_bbox), cv2.CV_64F).var()
         else:
             imageVar = 200
         # Estimate target bbox
-        img_g, img_l, out_flag = getbatch_actor(np.array(image), np.array(target_bbox).reshape([1, 4]))
-        deta_pos = actor(img_l, img_g)
-        deta_pos = deta_pos.data.clone().cpu().numpy()
+        if spec is not None and spec.deta_pos is not None and np.array_equal(spec.bbox, target_bbox):
+            out_flag = spec.out_flag
+            deta_pos = spec.deta_pos
+            n_spec += 1
+        else:
+            if opts['shared_backbone']:
+                share_search_region(model, frame, target_bbox)
+            img_g, img_l, out_flag = getbatch_actor(frame, np.array(target_bbox).reshape([1, 4]), shared)
+            deta_pos = actor(img_l, img_g, actor_in)
+            deta_pos = deta_pos.data.clone().cpu().numpy()
 
         if deta_pos[:, 2] > 0.05 or deta_pos[:, 2] < -0.05:
             deta_pos[:, 2] = 0
@@ -528,9 +1135,14 @@ def run_ACT(img_list, init_bbox, gt=None, savefig_dir='', display=False):
         if len(pf_frame) and i == (pf_frame[-1] + 1):
             deta_pos[:, 2] = 0
 
-        pos_ = np.round(move_crop(target_bbox, deta_pos, (image.size[1], image.size[0]), rate))
-        r = forward_samples(model, image, np.array(pos_).reshape([1, 4]), out_layer='fc6')
+        pos_ = np.round(move_crop(target_bbox, deta_pos, (frame.size[1], frame.size[0]), rate))
+        spec = None
+        if opts['pipeline_actor'] and not opts['shared_backbone'] and i + 1 < len(img_list):
+            spec = ActorSpeculation(actor, frames, pos_)
+        r = forward_samples(model, frame, np.array(pos_).reshape([1, 4]), out_layer='fc6')
         r = r.cpu().numpy()
+        # redetection scores its samples from their own crops
+        frame.search = None
 
         if r[0][1] > 0 and imageVar > 100:
             target_bbox = pos_
@@ -539,7 +1151,7 @@ def run_ACT(img_list, init_bbox, gt=None, savefig_dir='', display=False):
             success = 1
             if not out_flag:
                 fin_score = r[0][1]
-                img_learn.append(image)
+                img_learn.append(frame)
                 pos_learn.append(target_bbox)
                 score_pos.append(fin_score)
                 frame_learn.append(i)
@@ -558,6 +1170,7 @@ def run_ACT(img_list, init_bbox, gt=None, savefig_dir='', display=False):
                 pf_frame.append(i)
 
             if (len(frame_learn) == update_lenth*2 and data_frame[-1] not in frame_learn ) or data_frame[-1] == 0:
+                job = []
                 for num in range(max(0, img_learn.__len__() - update_lenth), img_learn.__len__()):
                     if frame_learn[num] not in data_frame:
                         gt_ = pos_learn[num]
@@ -568,8 +1181,13 @@ def run_ACT(img_list, init_bbox, gt=None, savefig_dir='', display=False):
                         neg_examples = np.round(gen_samples(neg_generator, gt_,
                                                             opts['n_neg_update'],
                                                             opts['overlap_neg_update']))
+                        if updater is not None:
+                            job.append((frame_learn[num], None, (image_, pos_examples, neg_examples)))
+                            continue
                         pos_feats_ = forward_samples(model, image_, pos_examples)
                         neg_feats_ = forward_samples(model, image_, neg_examples)
+                        image_.release()
+                        frame_stats += image_.pop_stats()
 
                         pos_feats_all.append(pos_feats_)
                         neg_feats_all.append(neg_feats_)
@@ -581,6 +1199,9 @@ def run_ACT(img_list, init_bbox, gt=None, savefig_dir='', display=False):
                     else:
                         pos_feats_ = pos_feats_all[data_frame.index(frame_learn[num])]
                         neg_feats_ = neg_feats_all[data_frame.index(frame_learn[num])]
+                        if updater is not None:
+                            job.append((frame_learn[num], (pos_feats_, neg_feats_), None))
+                            continue
 
                     if num == max(0, img_learn.__len__() - update_lenth):
                         pos_feats = pos_feats_
@@ -589,26 +1210,63 @@ def run_ACT(img_list, init_bbox, gt=None, savefig_dir='', display=False):
                     else:
                         pos_feats = torch.cat([pos_feats, pos_feats_], 0)
                         neg_feats = torch.cat([neg_feats, neg_feats_], 0)
-                train(model, criterion, update_optimizer, pos_feats, neg_feats, opts['maxiter_update'])
+                if updater is not None:
+                    updater.submit(job, opts['maxiter_update'])
+                else:
+                    train(model, criterion, update_optimizer, pos_feats, neg_feats, opts['maxiter_update'])
+                    # fc scores of this frame were taken before the update
+                    frame.memo.clear()
 
             if success:
                 sample_generator.set_trans_f(opts['trans_f'])
             else:
                 sample_generator.set_trans_f(opts['trans_f_expand'])
 
-            if imageVar < 100:
-                samples = gen_samples(init_generator, target_bbox, opts['n_samples'])
+            expand = i < 20 or out_flag or ((init_bbox[2] * init_bbox[3]) > 1000 and (target_bbox[2] * target_bbox[3] / (init_bbox[2] * init_bbox[3]) > 2.5 or target_bbox[2] * target_bbox[3] / (init_bbox[2] * init_bbox[3]) < 0.4))
+
+            dense = None
+            if opts['dense_search']:
+                if imageVar < 100:
+                    sizes = [target_bbox[2:4]]
+                else:
+                    sizes = [target_bbox[2:4] * opts['scale_f'] ** k for k in opts['dense_scales']]
+                if expand:
+                    sample_generator.set_trans_f(opts['trans_f_expand'])
+                    sizes.append(init_bbox[2:4])
+                dense = forward_dense(model, frame, target_bbox, sizes, sample_generator.get_trans_f())
+
+            if dense is not None:
+                samples, sample_scores, sample_feats = dense
             else:
-                samples = gen_samples(sample_generator, target_bbox, opts['n_samples'])
+                n_samples = opts['n_samples']
+                search_bbox = target_bbox
+                if opts['motion_model'] and success and imageVar >= 100:
+                    # sample around the predicted center, as wide as the motion
+                    # model is unsure, with the budget scaled to the search area
+                    trans_f = np.clip(2 * motion.sigma() / np.mean(target_bbox[2:4]), opts['trans_f_min'], opts['trans_f'])
+                    n_samples = int(np.clip(opts['n_samples'] * (trans_f / opts['trans_f']) ** 2,
+                                            opts['n_samples_min'], opts['n_samples']))
+                    search_bbox = np.hstack([motion.center() - target_bbox[2:4] / 2, target_bbox[2:4]])
+                    sample_generator.set_trans_f(trans_f)
+
+                if imageVar < 100:
+                    samples = gen_samples(init_generator, target_bbox, opts['n_samples'])
+                else:
+                    samples = gen_samples(sample_generator, search_bbox, n_samples)
 
-            if i < 20 or out_flag or ((init_bbox[2] * init_bbox[3]) > 1000 and (target_bbox[2] * target_bbox[3] / (init_bbox[2] * init_bbox[3]) > 2.5 or target_bbox[2] * target_bbox[3] / (init_bbox[2] * init_bbox[3]) < 0.4)):
+                if expand:
 
-                sample_generator.set_trans_f(opts['trans_f_expand'])
-                samples_ = np.round(gen_samples(sample_generator, np.hstack([target_bbox[0:2] + target_bbox[2:4] / 2 - init_bbox[2:4] / 2, init_bbox[2:4]]), opts['n_samples']))
-                samples = np.vstack([samples, samples_])
+                    sample_generator.set_trans_f(opts['trans_f_expand'])
+                    samples_ = np.round(gen_samples(sample_generator, np.hstack([target_bbox[0:2] + target_bbox[2:4] / 2 - init_bbox[2:4] / 2, init_bbox[2:4]]), opts['n_samples']))
+                    samples = np.vstack([samples, samples_])
 
-            sample_scores = forward_samples(model, image, samples, out_layer='fc6')
+                if opts['cascade']:
+                    samples = prefilter_samples(model, frame, samples)
+                sample_scores, sample_feats = forward_samples(model, frame, samples, out_layer=['fc6', 'conv3'])
+            # candidates the full critic scored to redetect the target
+            samples_log[i] = len(samples)
             top_scores, top_idx = sample_scores[:, 1].topk(5)
+            top_feats = sample_feats.index_select(0, top_idx)
             top_idx = top_idx.cpu().numpy()
             target_score = top_scores.mean()
             target_bbox = samples[top_idx].mean(axis=0)
@@ -617,11 +1275,11 @@ def run_ACT(img_list, init_bbox, gt=None, savefig_dir='', display=False):
             # Bbox regression
             if success:
                 bbreg_samples = samples[top_idx]
-                bbreg_feats = forward_samples(model, image, bbreg_samples)
+                bbreg_feats = top_feats
                 bbreg_samples = bbreg.predict(bbreg_feats, bbreg_samples)
                 bbreg_bbox = bbreg_samples.mean(axis=0)
 
-                img_learn.append(image)
+                img_learn.append(frame)
                 pos_learn.append(target_bbox)
                 score_pos.append(target_score)
                 frame_learn.append(i)
@@ -643,38 +1301,25 @@ def run_ACT(img_list, init_bbox, gt=None, savefig_dir='', display=False):
             result[i] = target_bbox
             result_bb[i] = bbreg_bbox
 
-        spf = time.time() - tic
-        spf_total += spf
-
-        # Display
-        if display or savefig:
-            im.set_data(image)
-
-            if gt is not None:
-                gt_rect.set_xy(gt[i, :2])
-                gt_rect.set_width(gt[i, 2])
-                gt_rect.set_height(gt[i, 3])
-
-            rect.set_xy(result_bb[i, :2])
-            rect.set_width(result_bb[i, 2])
-            rect.set_height(result_bb[i, 3])
-
-            if display:
-                plt.pause(.01)
-                plt.draw()
-            if savefig:
-                fig.savefig(os.path.join(savefig_dir, '%04d.jpg' % (i)), dpi=dpi)
-        if display:
-            if gt is None:
-                print "Frame %d/%d, Score %.3f, Time %.3f" % \
-                      (i, len(img_list), target_score, spf)
-            else:
-                if opts['show_train']:
-                    print "Frame %d/%d, Overlap %.3f, Score %.3f, Time %.3f, box (%d,%d,%d,%d), var %d" % \
-                          (i, len(img_list), overlap_ratio(gt[i], result_bb[i])[0], target_score, spf, target_bbox[0],
-                           target_bbox[1], target_bbox[2], target_bbox[3], imageVar)
-
-    fps = len(img_list) / spf_total
+        frame_stats += finish_frame(i, frame, tic)
+
+    if updater is not None:
+        updater.close()
+    fps = len(img_list) / spf_log.sum()
+    redetected = samples_log[samples_log > 0]
+    print "Redetection: %d of %d frames, candidates scored per redetection mean %.1f, max %d" % \
+          (len(redetected), len(img_list) - 1, redetected.mean() if len(redetected) else 0, samples_log.max())
+    if display:
+        print "Frame time: mean %.3f s, max %.3f s" % (spf_log[1:].mean(), spf_log.max())
+        print "Candidates: %d scored of %d, dedup ratio %.3f" % \
+              (frame_stats[1], frame_stats[0], 1 - float(frame_stats[1]) / max(frame_stats[0], 1))
+        if opts['prefetch']:
+            print "Frame prefetch: mean queue depth %.2f, %d waits of %d frames" % \
+                  (float(frames.depth_sum) / max(frames.n_gets, 1), frames.n_waits, frames.n_gets)
+        if opts['pipeline_actor']:
+            print "Speculative actor steps used: %d of %d frames" % (n_spec, len(img_list) - 1)
+        if updater is not None:
+            print "Background updates: %d run, %d replaced while waiting" % (updater.n_started, updater.n_replaced)
     return result, result_bb, fps
 
 
@@ -3,10 +3,10 @@ from numpy.random import seed
 seed(1)
 from tensorflow import set_random_seed
 set_random_seed(2)
-from scipy.misc import imresize
 import tensorflow as tf
 
 import os
+import sys
 os.environ['CUDA_VISIBLE_DEVICES'] = '1'
 
 from src.init_paras import paras_init
@@ -14,6 +14,8 @@ import skimage
 import skimage.io
 import skimage.transform
 from data_prov import *
+sys.path.insert(0, '../modules')
+from utils import crop_images
 
 
 VGG_MEAN = [128, 128, 128]
@@ -536,16 +538,11 @@ def getbatch(img, boxes, args):
     crop_size = args.sampling_input_size
 
     num_boxes = boxes.shape[0]
-    imo_g = np.zeros([num_boxes, crop_size, crop_size, 3])
-    imo_l = np.zeros([num_boxes, crop_size, crop_size, 3])
+    imo_g = np.empty([num_boxes, crop_size, crop_size, 3], dtype='float32')
+    imo_l = np.empty([num_boxes, crop_size, crop_size, 3], dtype='float32')
 
-    for i in range(num_boxes):
-
-        bbox = boxes[i]
-        img_crop_l, img_crop_g = crop_image(img, bbox)
-
-        imo_g[i] = img_crop_g
-        imo_l[i] = img_crop_l
+    crop_images(img, boxes, crop_size, 0, out=imo_l)
+    crop_images(img, boxes, crop_size, crop_size / 2, out=imo_g)
 
     return imo_g, imo_l
 
@@ -623,60 +620,8 @@ def cal_distance(samples, ground_th):
     return distance
 
 def crop_image(img, bbox, img_size=107, padding=0, valid=False):
-    x, y, w, h = np.array(bbox, dtype='float32')
-
-    half_w, half_h = w / 2, h / 2
-    center_x, center_y = x + half_w, y + half_h
-
-    if padding > 0:
-        pad_w = padding * w / img_size
-        pad_h = padding * h / img_size
-        half_w += pad_w
-        half_h += pad_h
-
-    img_h, img_w, _ = img.shape
-    min_x = int(center_x - half_w + 0.5)
-    min_y = int(center_y - half_h + 0.5)
-    max_x = int(center_x + half_w + 0.5)
-    max_y = int(center_y + half_h + 0.5)
-
-    if min_x >= 0 and min_y >= 0 and max_x <= img_w and max_y <= img_h:
-        cropped = img[min_y:max_y, min_x:max_x, :]
-
-    else:
-        min_x_val = max(0, min_x)
-        min_y_val = max(0, min_y)
-        max_x_val = min(img_w, max_x)
-        max_y_val = min(img_h, max_y)
-
-        cropped = 128 * np.ones((max_y - min_y, max_x - min_x, 3), dtype='uint8')
-        # try:
-        cropped[min_y_val - min_y:max_y_val - min_y, min_x_val - min_x:max_x_val - min_x, :] \
-            = img[min_y_val:max_y_val, min_x_val:max_x_val, :]
-        # except:
-        #     a= 1
-
-    scaled_l = imresize(cropped, (img_size, img_size))
-
-    min_x = int(center_x - w + 0.5)
-    min_y = int(center_y - h + 0.5)
-    max_x = int(center_x + w + 0.5)
-    max_y = int(center_y + h + 0.5)
-
-    if min_x >= 0 and min_y >= 0 and max_x <= img_w and max_y <= img_h:
-        cropped = img[min_y:max_y, min_x:max_x, :]
-
-    else:
-        min_x_val = max(0, min_x)
-        min_y_val = max(0, min_y)
-        max_x_val = min(img_w, max_x)
-        max_y_val = min(img_h, max_y)
-
-        cropped = 128 * np.ones((max_y - min_y, max_x - min_x, 3), dtype='uint8')
-        cropped[min_y_val - min_y:max_y_val - min_y, min_x_val - min_x:max_x_val - min_x, :] \
-            = img[min_y_val:max_y_val, min_x_val:max_x_val, :]
-
-    scaled_g = imresize(cropped, (img_size, img_size))
+    scaled_l = crop_images(img, bbox, img_size, padding)[0]
+    scaled_g = crop_images(img, bbox, img_size, img_size / 2)[0]
 
     return scaled_l, scaled_g
 